@@ -0,0 +1,184 @@
+"""
+Finds every finish for one athlete across all downloaded results.
+
+An inverted index (AthletePosting in races.db) maps normalized keys to results:
+  name:<full name>, bib:<bib> and town:<word> for every word of the hometown.
+It's brought up to date incrementally: new or changed CSVs are loaded with
+results_loader, and only races whose file changed since they were last indexed
+get their postings rebuilt.
+
+    python athlete_index.py --update
+    python athlete_index.py "Jane Doe" [--born 1985] [--hometown "Boulder"]
+"""
+import argparse
+import logging
+import re
+import unicodedata
+from typing import List, Optional
+
+from peewee import chunked, fn
+
+from models import AthletePosting, IndexedRace, RaceResult, ResultRace, db
+from results_loader import load_all
+
+# Stay under SQLite's (older) limit of 999 variables per statement
+BATCH_SIZE = 999 // 5
+NON_WORD = re.compile(r"[^a-z0-9]+")
+
+
+def normalize(text: str) -> str:
+    """
+    "  Zoë  O'Brien-Smith " -> "zoe o brien smith"
+    """
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return NON_WORD.sub(" ", text.lower()).strip()
+
+
+def result_keys(result: RaceResult) -> List[str]:
+    keys = [f"name:{normalize(result.name)}"]
+    if result.bib:
+        keys.append(f"bib:{normalize(result.bib)}")
+    keys.extend(f"town:{word}" for word in set(normalize(result.hometown).split()))
+    return keys
+
+
+def _race_results(race: ResultRace):
+    return RaceResult.select().where(
+        (RaceResult.event_id == race.event_id)
+        & (RaceResult.race_id == race.race_id)
+        & (RaceResult.bracket_id == race.bracket_id)
+    )
+
+
+def index_race(race: ResultRace) -> int:
+    """
+    (Re)builds the postings for one race.
+    :return: How many postings were written
+    """
+    race_key = (race.event_id, race.race_id, race.bracket_id)
+    postings = [
+        (key, *race_key, result.id)
+        for result in _race_results(race)
+        for key in result_keys(result)
+    ]
+    with db.atomic():
+        AthletePosting.delete().where(
+            (AthletePosting.event_id == race.event_id)
+            & (AthletePosting.race_id == race.race_id)
+            & (AthletePosting.bracket_id == race.bracket_id)
+        ).execute()
+        for batch in chunked(postings, BATCH_SIZE):
+            AthletePosting.insert_many(
+                batch,
+                fields=[
+                    AthletePosting.key,
+                    AthletePosting.event_id,
+                    AthletePosting.race_id,
+                    AthletePosting.bracket_id,
+                    AthletePosting.result_id,
+                ],
+            ).execute()
+        IndexedRace.replace(
+            event_id=race.event_id,
+            race_id=race.race_id,
+            bracket_id=race.bracket_id,
+            mtime=race.mtime,
+        ).execute()
+    return len(postings)
+
+
+def update() -> int:
+    """
+    Loads any new result files and indexes every race that isn't indexed yet,
+    or whose file changed since it was.
+    :return: How many races were (re)indexed
+    """
+    load_all()
+
+    indexed = {
+        (r.event_id, r.race_id, r.bracket_id): r.mtime for r in IndexedRace.select()
+    }
+    count = 0
+    for race in ResultRace.select():
+        if indexed.get((race.event_id, race.race_id, race.bracket_id)) == race.mtime:
+            continue
+        postings = index_race(race)
+        logging.info(f"Indexed {race.name} {race.heat} ({postings:,} postings)")
+        count += 1
+    return count
+
+
+def find_athlete(name: str, born: Optional[int] = None, hometown: Optional[str] = None):
+    """
+    Every finish for a (normalized) name, oldest first.
+    :param: born: Only results where year - age is within a year of this
+    :param: hometown: Only results whose hometown has all of these words
+    """
+    query = (
+        RaceResult.select(RaceResult, ResultRace)
+        .join(AthletePosting, on=(AthletePosting.result_id == RaceResult.id))
+        .switch(RaceResult)
+        .join(
+            ResultRace,
+            on=(
+                (RaceResult.event_id == ResultRace.event_id)
+                & (RaceResult.race_id == ResultRace.race_id)
+                & (RaceResult.bracket_id == ResultRace.bracket_id)
+            ),
+        )
+        .where(AthletePosting.key == f"name:{normalize(name)}")
+    )
+    if born is not None:
+        query = query.where(fn.ABS(ResultRace.year - RaceResult.age - born) <= 1)
+    for word in normalize(hometown or "").split():
+        query = query.where(
+            RaceResult.id.in_(
+                AthletePosting.select(AthletePosting.result_id).where(
+                    AthletePosting.key == f"town:{word}"
+                )
+            )
+        )
+    return query.order_by(ResultRace.year, RaceResult.event_id)
+
+
+def find_bib(bib: str):
+    return RaceResult.select().where(
+        RaceResult.id.in_(
+            AthletePosting.select(AthletePosting.result_id).where(
+                AthletePosting.key == f"bib:{normalize(bib)}"
+            )
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("name", nargs="?", help="Athlete to look up")
+    parser.add_argument("--born", type=int, help="Birth year, give or take one")
+    parser.add_argument("--hometown", help="Words that must be in their hometown")
+    parser.add_argument(
+        "--update", action="store_true", help="Index new result files first"
+    )
+    args = parser.parse_args()
+
+    if args.update:
+        logging.info(f"Indexed {update()} races")
+    if not args.name:
+        return
+
+    for result in find_athlete(args.name, args.born, args.hometown):
+        race = result.resultrace
+        print(
+            f"{race.year} {race.name} ({race.heat}): #{result.rank} "
+            f"{result.name}, {result.age} {result.gender} {result.division} "
+            f"from {result.hometown} in {result.duration // 3600}:"
+            f"{result.duration // 60 % 60:02}:{result.duration % 60:02}"
+        )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        format="%(asctime)s - %(levelname)s: %(message)s", level=logging.INFO
+    )
+    main()
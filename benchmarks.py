@@ -0,0 +1,245 @@
+"""
+Micro-benchmarks for the hot paths, run with `python benchmarks.py`.
+Everything here is offline, built from synthetic but realistically shaped data.
+"""
+import json
+import logging
+import random
+import re
+import timeit
+from datetime import date, timedelta
+from typing import Any, Dict, List
+
+import requests
+
+import chronotrack
+from gsheet_exporter import EventRow, race_info_requests
+from models import Event, Race
+from results_fetcher import RacerResult, decode_page
+
+
+def _fake_results_page(rows: int) -> List[List[Any]]:
+    def duration():
+        return f"{random.randint(0, 5)}:{random.randint(0, 59):02}:00"
+
+    return [
+        [
+            idx,
+            str(idx),
+            f"Racer {idx}",
+            str(1000 + idx),
+            duration(),
+            "12:34",
+            "Somewhere, CA",
+            str(random.randint(14, 80)),
+            random.choice("MF"),
+            "M30-34",
+            str(idx),
+        ]
+        for idx in range(1, rows + 1)
+    ]
+
+
+def _legacy_build(raw_input: List[Any]) -> RacerResult:
+    # RacerResult.build as it used to be, for comparison
+    field_types = list(RacerResult.__annotations__.values())
+    field_count = len(field_types)
+    assert len(raw_input) == field_count, "lol what is this even?"
+
+    raw_input[4] = sum(
+        a * b for a, b in zip([3600, 60, 1], map(int, raw_input[4].split(":")))
+    )
+    return RacerResult(*[field_types[i](raw_input[i]) for i in range(field_count)])
+
+
+def bench_decode_page(rows=500, repeat=200) -> None:
+    page = _fake_results_page(rows)
+    assert [_legacy_build(list(r)) for r in page] == decode_page(page)
+
+    legacy = timeit.timeit(
+        lambda: [_legacy_build(list(r)) for r in page], number=repeat
+    )
+    batched = timeit.timeit(lambda: decode_page(page), number=repeat)
+    logging.info(
+        f"decode_page: per-row build {rows * repeat / legacy:,.0f} rows/s, "
+        f"batched {rows * repeat / batched:,.0f} rows/s "
+        f"({legacy / batched:.1f}x)"
+    )
+
+
+def bench_decode_jsonp(rows=500, repeat=50) -> None:
+    body = b"(" + json.dumps({"aaData": _fake_results_page(rows)}).encode() + b");"
+    # Like a real response, no charset header so .text has to detect one
+    response = requests.Response()
+    response._content = body
+    response.encoding = None
+    assert json.loads(response.text[1:-2]) == chronotrack.decode_response(response)
+
+    legacy = timeit.timeit(lambda: json.loads(response.text[1:-2]), number=repeat)
+    decoded = timeit.timeit(
+        lambda: chronotrack.decode_response(response), number=repeat
+    )
+    backend = "orjson" if chronotrack.orjson else "json"
+    logging.info(
+        f"JSONP {len(body):,} byte page: .text + json {repeat / legacy:,.1f} pages/s, "
+        f"decode_response ({backend}) {repeat / decoded:,.1f} pages/s "
+        f"({legacy / decoded:.1f}x)"
+    )
+
+
+def _fake_race_names(count: int) -> List[str]:
+    places = ["Virginia", "Big Bear", "Sacramento", "Las Vegas", "Tahoe", "Dallas"]
+    formats = ["Sprint", "Super and Sprint", "Beast & Ultra", "Kids Race", "HH"]
+    return [
+        f"{random.choice(places)} Spartan {random.choice(formats)} Weekend 2023"
+        for _ in range(count)
+    ]
+
+
+def _legacy_normalize_race_name(race_name: str) -> str:
+    # EventRow.normalize_race_name as it used to be, for comparison
+    for fragment in EventRow.NAME_FRAGMENTS_TO_DELETE:
+        race_name = race_name.replace(fragment, "")
+    race_name = re.sub(r" (\w+/)+\w+ ", "", race_name)
+    race_name = re.sub(r"[a-zA-Z]+ \d+-\d+", "", race_name)
+    race_name = re.sub(r"\b(\w+)( +\1\b)+", r"\1", race_name)
+    race_name = re.sub(r"\s+", " ", race_name)
+    return race_name.strip()
+
+
+class _LegacyEventRow:
+    # Just the per-row work EventRow used to do: normalizing and setattr flags
+    def __init__(self, race: Race, events: List[Event]) -> None:
+        self.start_date = race.start_date
+        self.name = _legacy_normalize_race_name(race.name)
+        self.event_id = race.spartan_id
+        event_categories = [
+            e.category for e in events if e.category not in EventRow.IGNORED_CATEGORIES
+        ]
+        unknown_categories = set(event_categories) - set(
+            EventRow.EVENT_CATEGORY_REPLACEMENTS.keys()
+        )
+        if unknown_categories:
+            raise Exception(f"idk how to handle {unknown_categories} categories")
+        for category in EventRow.EVENT_CATEGORY_REPLACEMENTS.values():
+            setattr(self, category, False)
+        for category in event_categories:
+            setattr(self, EventRow.EVENT_CATEGORY_REPLACEMENTS[category], True)
+
+
+def bench_event_rows(rows=3000, repeat=5) -> None:
+    # A season's worth of races, whose names repeat from year to year
+    names = _fake_race_names(rows // 4)
+    races_and_events = []
+    for event_row in _fake_event_rows(rows):
+        race = Race(
+            spartan_id=event_row.event_id,
+            name=random.choice(names),
+            start_date=event_row.start_date,
+        )
+        events = [
+            Event(category=category)
+            for category, bit in EventRow.EVENT_CATEGORY_BITS.items()
+            if event_row.categories & bit
+        ] + [Event(category="trifectapass")]
+        races_and_events.append((race, events))
+
+    for race, events in races_and_events:
+        legacy_row = _LegacyEventRow(race, events)
+        event_row = EventRow(race, events, normalize_race_name=True)
+        assert legacy_row.name == event_row.name
+        assert all(
+            getattr(legacy_row, field) == event_row.has(field)
+            for field in EventRow.RACE_ORDER
+        )
+
+    legacy = timeit.timeit(
+        lambda: [_LegacyEventRow(r, e) for r, e in races_and_events], number=repeat
+    )
+    EventRow.normalize_race_name.cache_clear()
+    compiled = timeit.timeit(
+        lambda: [EventRow(r, e, normalize_race_name=True) for r, e in races_and_events],
+        number=repeat,
+    )
+    logging.info(
+        f"EventRow: legacy {rows * repeat / legacy:,.0f} rows/s, "
+        f"compiled/cached {rows * repeat / compiled:,.0f} rows/s "
+        f"({legacy / compiled:.1f}x)"
+    )
+
+
+def _fake_event_rows(rows: int) -> List[EventRow]:
+    # Typical weekends, and roughly how often they come up
+    weekends = [
+        ["spartankids", "spartansprint", "spartansuper", "spartanbeast"],
+        ["spartankids", "spartansprint", "spartansuper"],
+        ["spartankids", "spartansprint"],
+        ["spartansprint", "spartansuper"],
+        ["spartanbeast", "spartanultra"],
+        ["stadion", "spartankids"],
+        ["trail_10k", "trail_21k"],
+        ["trail_21k", "trail_50k", "trail_100k"],
+    ]
+    weights = [25, 25, 15, 10, 5, 10, 5, 5]
+    event_rows = []
+    for idx in range(rows):
+        race = Race(
+            spartan_id=idx,
+            name=f"Race {idx}",
+            start_date=date(2024, 1, 1) + timedelta(days=idx),
+            venue_name="Somewhere",
+            country="USA",
+            region="CA",
+            latitude=0.0,
+            longitude=0.0,
+        )
+        chosen = list(random.choices(weekends, weights)[0])
+        if random.random() < 0.1:
+            chosen.append("hurricane-heat")
+        event_rows.append(EventRow(race, [Event(category=c) for c in chosen]))
+    return event_rows
+
+
+def _legacy_race_info_requests(events: List[EventRow]) -> List[Dict]:
+    # One updateCells per checkbox, as set_race_info used to send
+    return [
+        {
+            "updateCells": {
+                "rows": [
+                    {"values": [{"dataValidation": {"condition": {"type": "BOOLEAN"}}}]}
+                ],
+                "fields": "dataValidation",
+                "start": {"sheetId": 0, "rowIndex": row, "columnIndex": column},
+            }
+        }
+        for idx, event in enumerate(events)
+        for row, column in sorted(event.checkbox_cells(3 + idx))
+    ]
+
+
+def bench_checkbox_requests(rows=500) -> None:
+    events = _fake_event_rows(rows)
+    legacy = _legacy_race_info_requests(events)
+    grid = race_info_requests(events)
+    legacy_bytes = len(json.dumps({"requests": legacy}))
+    grid_bytes = len(json.dumps({"requests": grid}))
+    logging.info(
+        f"race_info_requests for {rows} rows: per-cell {len(legacy):,} requests "
+        f"({legacy_bytes:,} bytes), grid {len(grid):,} requests "
+        f"({grid_bytes:,} bytes, {legacy_bytes / grid_bytes:.1f}x smaller)"
+    )
+
+
+def main():
+    random.seed(42)
+    bench_decode_page()
+    bench_decode_jsonp()
+    bench_checkbox_requests()
+    bench_event_rows()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        format="%(asctime)s - %(levelname)s: %(message)s", level=logging.INFO
+    )
+    main()
@@ -0,0 +1,119 @@
+"""
+Decoding for chronotrack's JSONP responses, e.g. `({"model": ...});`, and a
+cached client for their (per event) load-model endpoint.
+
+The JSON is parsed straight out of the response bytes: no charset detection and
+no decoded copy of the whole body via `response.text`, and with orjson installed
+not even a copy of the bytes. The wrapper is checked rather than blindly
+sliced off, so if chronotrack ever changes it we fail loudly instead of parsing
+garbage (or half a document).
+
+Event models are kept in MODEL_CACHE, so once an event has been seen (by
+race_finder, race_section_fetcher or event_addendum) anything else wanting its
+model reads it from disk.
+"""
+import json
+import re
+from datetime import datetime
+from typing import Any, Optional
+
+from http_client import CLIENT
+from response_cache import DAY, ResponseCache
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+LOAD_MODEL = "https://results.chronotrack.com/embed/results/load-model"
+MODEL_CACHE = ResponseCache("chronotrack_cache")
+START_TIME_FORMATS = ["%b %d, %Y %I:%M%p", "%d %b, %Y %I:%M%p"]
+# Past events' models hardly ever change, upcoming ones still might
+PAST_MODEL_TTL = 365 * DAY
+UPCOMING_MODEL_TTL = DAY
+
+# An optional callback name, then the opening paren
+JSONP_START = re.compile(rb"\s*(?:[A-Za-z_$][\w$.]*)?\(")
+JSONP_END = re.compile(rb"\)\s*;?\s*\Z")
+# How much of either end of the body the wrapper could be in
+WRAPPER_WINDOW = 128
+
+
+class JSONPError(ValueError):
+    pass
+
+
+def decode_jsonp(content: bytes) -> Any:
+    """
+    :param: content: The raw response body
+    :raises: JSONPError if it isn't wrapped as JSONP, ValueError if the JSON
+      inside isn't valid
+    """
+    start = JSONP_START.match(content, 0, WRAPPER_WINDOW)
+    tail_start = max(0, len(content) - WRAPPER_WINDOW)
+    end = JSONP_END.search(content, tail_start)
+    if not start or not end or end.start() < start.end():
+        raise JSONPError(
+            f"Not JSONP: {content[:40]!r}...{content[-40:]!r} ({len(content)} bytes)"
+        )
+
+    payload = memoryview(content)[start.end() : end.start()]
+    if orjson is not None:
+        return orjson.loads(payload)
+    return json.loads(str(payload, "utf-8"))
+
+
+def decode_response(response) -> Any:
+    """
+    Decodes a requests.Response from chronotrack.
+    """
+    return decode_jsonp(response.content)
+
+
+def fetch_event_model(event_id: int):
+    """
+    Fetches an event's JSONP model from chronotrack, skipping the cache.
+    :return: The requests.Response
+    """
+    return CLIENT.get(
+        LOAD_MODEL, params={"modelID": "event", "eventID": event_id}, timeout=30
+    )
+
+
+def _start_time(model) -> Optional[datetime]:
+    for start_time_format in START_TIME_FORMATS:
+        try:
+            return datetime.strptime(model.get("start_time", ""), start_time_format)
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+def save_event_model(event_id: int, content: bytes, info) -> None:
+    """
+    Caches a load-model response body, with `info` being what it decodes to.
+    """
+    start_time = _start_time(info.get("model") or {})
+    upcoming = start_time is None or start_time > datetime.now()
+    MODEL_CACHE.put(
+        f"load-model/event/{event_id}",
+        content,
+        ttl=UPCOMING_MODEL_TTL if upcoming else PAST_MODEL_TTL,
+    )
+
+
+def get_event_model(event_id: int):
+    """
+    An event's decoded load-model response, from MODEL_CACHE if we've seen it.
+    :raises: requests.HTTPError if it had to be fetched and that failed
+    """
+    content = MODEL_CACHE.get(f"load-model/event/{event_id}")
+    if content is not None:
+        return decode_jsonp(content)
+
+    response = fetch_event_model(event_id)
+    response.raise_for_status()
+    info = decode_response(response)
+    save_event_model(event_id, response.content, info)
+    return info
@@ -0,0 +1,133 @@
+"""
+Typed, column-oriented copies of the results CSVs.
+
+Each race becomes one compressed .npz holding one NumPy array per RacerResult
+field, partitioned by year and event as
+race-results-columnar/<year>/<event_id>/<race_id>-<bracket_id>.npz, so loading
+years of results for analysis never has to re-parse text.
+
+NumPy is optional: results_fetcher only writes these when asked to, and running
+this module directly back-fills them from an existing race-results tree.
+"""
+import glob
+import logging
+import os
+from typing import Dict, Iterable, List, Optional
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from results_fetcher import RacerResult, read_results
+
+
+CSV_DIR = "race-results"
+COLUMNAR_DIR = "race-results-columnar"
+NUMPY_TYPES = {int: "int32", str: "U"}
+
+
+def _require_numpy() -> None:
+    if np is None:
+        raise ImportError("Columnar results need numpy, try `pip install numpy`")
+
+
+def columnar_path(year: int, event_id: int, race_id: int, bracket_id: int) -> str:
+    return os.path.join(
+        COLUMNAR_DIR, str(year), str(event_id), f"{race_id}-{bracket_id}.npz"
+    )
+
+
+def to_columns(rows: Iterable[RacerResult]) -> Dict[str, "np.ndarray"]:
+    _require_numpy()
+    rows = list(rows)
+    columns = {}
+    for idx, (name, field_type) in enumerate(RacerResult.__annotations__.items()):
+        columns[name] = np.array(
+            [row[idx] for row in rows], dtype=NUMPY_TYPES[field_type]
+        )
+    return columns
+
+
+def write_columns(out_path: str, rows: Iterable[RacerResult]) -> None:
+    columns = to_columns(rows)
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    tmp_path = out_path + ".tmp.npz"
+    np.savez_compressed(tmp_path, **columns)
+    os.replace(tmp_path, out_path)
+
+
+def convert_csv(csv_path: str, year: int) -> Optional[str]:
+    """
+    Writes the columnar copy of one results CSV, named the way results_fetcher
+    names them (<event_id>-<race_id>-<bracket_id>.csv), unless it's up to date.
+    """
+    event_id, race_id, bracket_id = (
+        os.path.basename(csv_path).rsplit(".", 1)[0].split("-")
+    )
+    out_path = columnar_path(year, int(event_id), int(race_id), int(bracket_id))
+    if os.path.exists(out_path) and os.path.getmtime(out_path) >= os.path.getmtime(
+        csv_path
+    ):
+        return None
+
+    write_columns(out_path, read_results(csv_path))
+    return out_path
+
+
+def load_columns(npz_path: str) -> Dict[str, "np.ndarray"]:
+    _require_numpy()
+    with np.load(npz_path) as data:
+        return {name: data[name] for name in data.files}
+
+
+def load_partition(
+    year: Optional[int] = None, event_id: Optional[int] = None
+) -> Dict[str, "np.ndarray"]:
+    """
+    Loads and concatenates every race under a year and/or event, adding
+    `year`, `event_id`, `race_id` and `bracket_id` columns to tell them apart.
+    """
+    _require_numpy()
+    pattern = os.path.join(
+        COLUMNAR_DIR,
+        "*" if year is None else str(year),
+        "*" if event_id is None else str(event_id),
+        "*.npz",
+    )
+
+    parts: Dict[str, List["np.ndarray"]] = {}
+    for npz_path in sorted(glob.glob(pattern)):
+        columns = load_columns(npz_path)
+        rows = len(columns["id"])
+        event_dir = os.path.dirname(npz_path)
+        race_id, bracket_id = os.path.basename(npz_path)[: -len(".npz")].split("-")
+        year_dir = os.path.dirname(event_dir)
+        columns["year"] = np.full(rows, int(os.path.basename(year_dir)))
+        columns["event_id"] = np.full(rows, int(os.path.basename(event_dir)))
+        columns["race_id"] = np.full(rows, int(race_id))
+        columns["bracket_id"] = np.full(rows, int(bracket_id))
+        for name, column in columns.items():
+            parts.setdefault(name, []).append(column)
+
+    return {name: np.concatenate(columns) for name, columns in parts.items()}
+
+
+def main():
+    _require_numpy()
+    for csv_path in sorted(glob.glob(os.path.join(CSV_DIR, "*", "*.csv"))):
+        year = int(os.path.basename(os.path.dirname(csv_path)))
+        try:
+            out_path = convert_csv(csv_path, year)
+        except Exception:
+            logging.exception(f"Skipping {csv_path}")
+            continue
+        if out_path:
+            logging.info(f"Wrote {out_path}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        format="%(asctime)s - %(levelname)s: %(message)s", level=logging.INFO
+    )
+    main()
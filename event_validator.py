@@ -1,26 +1,142 @@
+"""
+Picks the events with races out of raw_event_results/ into interesting_events.jsonl,
+one event per line, so later stages can stream them with iter_events().
+
+A manifest remembers each raw file's mtime and size, so a run only parses files
+that are new or have changed since the last one (in parallel). New events are
+appended to the output; it's only rewritten when a file that was already in it
+changes or disappears.
+"""
 import json
 import logging
 import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Set
+
+RAW_DIR = "raw_event_results"
+EVENTS_FILE = "interesting_events.jsonl"
+# What everything read before EVENTS_FILE, still used until the validator has run
+LEGACY_EVENTS_FILE = "interesting_events.json"
+MANIFEST_FILE = "event_validator_manifest.json"
+
+
+def iter_events(path: str = EVENTS_FILE) -> Iterator[Dict]:
+    """
+    Every interesting event, one at a time.
+    """
+    if not os.path.exists(path) and os.path.exists(LEGACY_EVENTS_FILE):
+        with open(LEGACY_EVENTS_FILE, "r", newline="") as in_f:
+            yield from json.load(in_f)
+        return
+
+    with open(path, "r", newline="") as in_f:
+        for line in in_f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def parse_file(path: str) -> Optional[Dict]:
+    """
+    :return: The event, or None if it has no races
+    """
+    with open(path, "r", newline="") as in_f:
+        info = json.load(in_f)
+    return info if info["races"] else None
+
+
+def load_manifest() -> Dict:
+    """
+    :return: {"files": {file name: [mtime, size]}, "output_bytes": ...} for what
+      the last run saw, or an empty manifest if it doesn't match EVENTS_FILE (say
+      we died between writing one and the other)
+    """
+    try:
+        with open(MANIFEST_FILE, "r", newline="") as in_f:
+            manifest = json.load(in_f)
+    except (OSError, ValueError):
+        return {"files": {}, "output_bytes": None}
 
+    output_bytes = os.path.getsize(EVENTS_FILE) if os.path.exists(EVENTS_FILE) else None
+    if manifest.get("output_bytes") != output_bytes:
+        logging.warning(f"{MANIFEST_FILE} is out of date, revalidating everything")
+        return {"files": {}, "output_bytes": None}
+    return manifest
 
-def main():
-    interesting_events = []
 
-    raw_dir = "raw_event_results"
-    for f in os.listdir(raw_dir):
-        if not f.endswith(".json"):
-            continue
+def save_manifest(manifest: Dict) -> None:
+    manifest["output_bytes"] = os.path.getsize(EVENTS_FILE)
+    with open(MANIFEST_FILE + ".tmp", "w", newline="") as out_f:
+        json.dump(manifest, out_f)
+    os.replace(MANIFEST_FILE + ".tmp", MANIFEST_FILE)
+
+
+def write_events(events: List[Dict], drop: Optional[Set[str]] = None) -> None:
+    """
+    Appends `events` to EVENTS_FILE.
+    :param: drop: Event ids to take out of EVENTS_FILE first, which means
+      rewriting it. An empty set starts it afresh.
+    """
+    if drop is None and os.path.exists(EVENTS_FILE):
+        with open(EVENTS_FILE, "a", newline="") as out_f:
+            for info in events:
+                out_f.write(json.dumps(info) + "\n")
+        return
+
+    with open(EVENTS_FILE + ".tmp", "w", newline="") as out_f:
+        if drop and os.path.exists(EVENTS_FILE):
+            for info in iter_events():
+                if str(info["event"]) not in drop:
+                    out_f.write(json.dumps(info) + "\n")
+        for info in events:
+            out_f.write(json.dumps(info) + "\n")
+    os.replace(EVENTS_FILE + ".tmp", EVENTS_FILE)
+
+
+def main(workers: Optional[int] = None):
+    """
+    :param: workers: Processes to parse with, defaults to one per CPU
+    """
+    manifest = load_manifest()
+    known = manifest["files"]
+
+    current = {}
+    with os.scandir(RAW_DIR) as entries:
+        for entry in entries:
+            if entry.name.endswith(".json"):
+                stat = entry.stat()
+                current[entry.name] = [stat.st_mtime, stat.st_size]
+
+    changed = [f for f, signature in current.items() if known.get(f) != signature]
+    removed = [f for f in known if f not in current]
+    if not changed and not removed:
+        logging.info("No new or changed events")
+        return
+    logging.info(
+        f"Validating {len(changed)} new or changed files, {len(removed)} removed"
+    )
+
+    # Raw files are named after their event, so that's what to take back out of
+    # the output for any that were in it. Without a manifest, start it afresh.
+    drop = None
+    if not known:
+        drop = set()
+    elif removed or any(f in known for f in changed):
+        drop = {f[: -len(".json")] for f in removed + changed if f in known}
 
-        with open(os.path.join(raw_dir, f), "r", newline="") as in_f:
-            info = json.load(in_f)
-            if not info["races"]:
-                continue
+    events = []
+    with ProcessPoolExecutor(workers) as executor:
+        paths = [os.path.join(RAW_DIR, f) for f in changed]
+        for f, info in zip(changed, executor.map(parse_file, paths, chunksize=64)):
+            known[f] = current[f]
+            if info is not None:
+                logging.info(f"Found {info['name']} with {len(info['races'])} races!")
+                events.append(info)
+    for f in removed:
+        del known[f]
 
-            logging.info(f"Found {info['name']} with {len(info['races'])} races!")
-            interesting_events.append(info)
-    logging.info(f"Found {len(interesting_events)} interesting events, persisting.")
-    with open("interesting_events.json", "w+", newline="") as out_f:
-        json.dump(interesting_events, out_f)
+    logging.info(f"Found {len(events)} interesting events, persisting.")
+    write_events(events, drop)
+    save_manifest(manifest)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,247 @@
+"""
+An in-memory stand in for the bits of the Google Sheets v4 API that
+gsheet_exporter uses, so an export can be run (and measured) offline.
+
+    service = FakeSheetsService()
+    gsheet_exporter.update_sheet(service, "any-sheet-id", event_rows)
+    service.round_trips, service.batch_updates, service.values[(3, 0)]
+
+Cells are keyed by 0-based (row, column), like the Sheets API's grid ranges.
+"""
+import json
+import re
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+A1_CELL = re.compile(r"([A-Z]+)(\d*)")
+
+
+def parse_a1(range_name: str) -> Tuple[int, int, Optional[int], int]:
+    """
+    "Q4:S10" -> (3, 16, 10, 19), i.e. start row/column and (exclusive) end
+    row/column. A single cell like "Q1" covers just that cell, and an open ended
+    range like "A4:S" has None as its end row.
+    """
+    cells = []
+    for cell in range_name.split("!")[-1].split(":"):
+        match = A1_CELL.fullmatch(cell)
+        if not match:
+            raise ValueError(f"Unsupported range {range_name}")
+        letters, row = match.groups()
+        column = 0
+        for letter in letters:
+            column = column * 26 + ord(letter) - ord("A") + 1
+        cells.append((int(row) - 1 if row else None, column - 1))
+    (start_row, start_column), (end_row, end_column) = cells[0], cells[-1]
+    return (
+        start_row,
+        start_column,
+        end_row + 1 if end_row is not None else None,
+        end_column + 1,
+    )
+
+
+class _Request:
+    def __init__(self, service: "FakeSheetsService", body: Any, run: Callable):
+        self._service = service
+        self._body = body
+        self._run = run
+
+    def execute(self):
+        self._service.round_trips += 1
+        self._service.payload_bytes += len(json.dumps(self._body))
+        return self._run()
+
+
+class _Values:
+    def __init__(self, service: "FakeSheetsService"):
+        self._service = service
+
+    def batchUpdate(self, spreadsheetId: str, body: Dict) -> _Request:
+        def run():
+            self._service.batch_updates += 1
+            for value_range in body["data"]:
+                self._service.set_values(value_range["range"], value_range["values"])
+            return {
+                "totalUpdatedCells": sum(
+                    len(row) for r in body["data"] for row in r["values"]
+                )
+            }
+
+        return _Request(self._service, body, run)
+
+    def update(
+        self, spreadsheetId: str, range: str, valueInputOption: str, body: Dict
+    ) -> _Request:
+        return _Request(
+            self._service,
+            body,
+            lambda: self._service.set_values(range, body["values"]),
+        )
+
+    def get(self, spreadsheetId: str, range: str, **kwargs) -> _Request:
+        return _Request(
+            self._service,
+            {"range": range},
+            lambda: {"range": range, "values": self._service.get_values(range)},
+        )
+
+
+class _Spreadsheets:
+    def __init__(self, service: "FakeSheetsService"):
+        self._service = service
+
+    def values(self) -> _Values:
+        return _Values(self._service)
+
+    def get(self, spreadsheetId: str, ranges: List[str], **kwargs) -> _Request:
+        """
+        Grid data for each range, as includeGridData=True would give it (every
+        field, whatever `fields` asked for).
+        """
+        return _Request(
+            self._service,
+            {"ranges": ranges},
+            lambda: {
+                "sheets": [{"data": [self._service.get_grid_data(r) for r in ranges]}]
+            },
+        )
+
+    def batchUpdate(self, spreadsheetId: str, body: Dict) -> _Request:
+        def run():
+            self._service.batch_updates += 1
+            for request in body["requests"]:
+                self._service.apply(request)
+            return {"replies": [{} for _ in body["requests"]]}
+
+        return _Request(self._service, body, run)
+
+
+class FakeSheetsService:
+    def __init__(self) -> None:
+        self.values: Dict[Tuple[int, int], Any] = {}
+        self.validation: Dict[Tuple[int, int], Dict] = {}
+        self.round_trips = 0
+        # Of the round trips, how many were (values or spreadsheets) batchUpdates
+        self.batch_updates = 0
+        self.payload_bytes = 0
+
+    def spreadsheets(self) -> _Spreadsheets:
+        return _Spreadsheets(self)
+
+    def set_values(self, range_name: str, rows: List[List[Any]]) -> None:
+        start_row, start_column, _, _ = parse_a1(range_name)
+        for row_offset, row in enumerate(rows):
+            for column_offset, value in enumerate(row):
+                cell = (start_row + row_offset, start_column + column_offset)
+                if value == "":
+                    self.values.pop(cell, None)
+                else:
+                    self.values[cell] = value
+
+    def _end_row(self) -> int:
+        cells = list(self.values) + list(self.validation)
+        return max((row for row, _ in cells), default=-1) + 1
+
+    def get_values(self, range_name: str) -> List[List[Any]]:
+        """
+        Like the real API, trailing empty rows and cells are left off.
+        """
+        start_row, start_column, end_row, end_column = parse_a1(range_name)
+        if end_row is None:
+            end_row = self._end_row()
+        rows = []
+        for row in range(start_row, end_row):
+            cells = [
+                self.values.get((row, column), "")
+                for column in range(start_column, end_column)
+            ]
+            while cells and cells[-1] == "":
+                cells.pop()
+            rows.append(cells)
+        while rows and not rows[-1]:
+            rows.pop()
+        return rows
+
+    def get_grid_data(self, range_name: str) -> Dict:
+        start_row, start_column, end_row, end_column = parse_a1(range_name)
+        if end_row is None:
+            end_row = self._end_row()
+        row_data = []
+        for row in range(start_row, end_row):
+            cells = []
+            for column in range(start_column, end_column):
+                cell: Dict[str, Any] = {}
+                value = self.values.get((row, column))
+                if value is not None:
+                    text = str(value)
+                    if text.startswith("="):
+                        cell["userEnteredValue"] = {"formulaValue": text}
+                    else:
+                        cell["userEnteredValue"] = {"stringValue": text}
+                        cell["formattedValue"] = text
+                if (row, column) in self.validation:
+                    cell["dataValidation"] = self.validation[(row, column)]
+                cells.append(cell)
+            while cells and not cells[-1]:
+                cells.pop()
+            row_data.append({"values": cells} if cells else {})
+        while row_data and not row_data[-1]:
+            row_data.pop()
+        return {"startRow": start_row, "startColumn": start_column, "rowData": row_data}
+
+    def _shift_rows(self, start: int, delta: int) -> None:
+        """
+        Inserts `delta` empty rows at `start`, or if it's negative, deletes that
+        many rows starting there.
+        """
+        for cells in (self.values, self.validation):
+            moved = {}
+            for (row, column), value in list(cells.items()):
+                if row < start:
+                    continue
+                del cells[(row, column)]
+                if row >= start - min(delta, 0):
+                    moved[(row + delta, column)] = value
+            cells.update(moved)
+
+    def _set_validation(self, cell: Tuple[int, int], data: Dict) -> None:
+        if "dataValidation" in data:
+            self.validation[cell] = data["dataValidation"]
+        else:
+            self.validation.pop(cell, None)
+
+    def apply(self, request: Dict) -> None:
+        """
+        Applies one spreadsheets.batchUpdate request. Only data validation is
+        tracked, since that's the only formatting the exporter sets, and only
+        ROWS dimensions are supported.
+        """
+        if "updateCells" in request:
+            update = request["updateCells"]
+            start = update["start"]
+            for row_offset, row in enumerate(update["rows"]):
+                for column_offset, data in enumerate(row["values"]):
+                    self._set_validation(
+                        (
+                            start["rowIndex"] + row_offset,
+                            start["columnIndex"] + column_offset,
+                        ),
+                        data,
+                    )
+        elif "repeatCell" in request:
+            repeat = request["repeatCell"]
+            grid = repeat["range"]
+            for row in range(grid["startRowIndex"], grid["endRowIndex"]):
+                for column in range(grid["startColumnIndex"], grid["endColumnIndex"]):
+                    self._set_validation((row, column), repeat["cell"])
+        elif "insertDimension" in request:
+            rows = request["insertDimension"]["range"]
+            self._shift_rows(rows["startIndex"], rows["endIndex"] - rows["startIndex"])
+        elif "deleteDimension" in request:
+            rows = request["deleteDimension"]["range"]
+            self._shift_rows(rows["startIndex"], rows["startIndex"] - rows["endIndex"])
+        else:
+            raise ValueError(
+                f"FakeSheetsService can't apply {', '.join(request)} requests, only "
+                "updateCells, repeatCell, insertDimension and deleteDimension"
+            )
@@ -1,14 +1,20 @@
 #!/usr/bin/env python3
 
+import gzip
+import hashlib
 import json
 import logging
 import os
 from datetime import date, datetime
-from typing import List
+from typing import Dict, List, Optional
 
-import requests
+from peewee import chunked
 
-from models import Race, Event
+from http_client import CLIENT
+from models import BaseModel, Change, Event, Race, db, migrate_db
+
+# What the last successful run fetched, see main()
+SNAPSHOT_FILE = "race_info_snapshot.json.gz"
 
 
 def _load(file_name: str):
@@ -17,26 +23,39 @@ def _load(file_name: str):
         raise FileNotFoundError()
 
     logging.info(f"Asked to use persisted stuff and found {file_name}!")
-    with open(file_name) as in_f:
+    with gzip.open(file_name, "rt") as in_f:
         return json.load(in_f)
 
 
 def _save(file_name: str, info):
     try:
-        with open(file_name, "w") as out_f:
+        with gzip.open(file_name + ".tmp", "wt") as out_f:
             json.dump(info, out_f)
+        os.replace(file_name + ".tmp", file_name)
         logging.info(f"Persisted to {file_name}")
     except OSError:
         logging.exception(f"Couldn't persist to {file_name} but continuing")
 
 
-def fetch_raw_race_info(persist: bool = False, file_name: str = None) -> List:
+def content_hash(document) -> str:
+    """
+    SHA-256 of a JSON document, the same however Spartan happened to order keys.
+    """
+    canonical = json.dumps(document, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def fetch_raw_race_info(
+    persist: bool = False, file_name: str = None, snapshot: Optional[Dict] = None
+) -> List:
     """
     Will fetch race info from spartan.com, unless file_name already exists, in which
     case that will be used. Any issues with that file will cause us to simply
     re-fetch from the internet.
     :param: persist: Should we try to load/save from some path?
-    :param: file_name: If we should try to load/save, from where?
+    :param: file_name: If we should try to load/save, from where? (gzipped JSON)
+    :param: snapshot: The last run's snapshot (see main), to make the request
+      conditional on. Its etag/last_modified are updated from the response.
     :return: A list of dicts of races
     """
     if persist:
@@ -50,8 +69,14 @@ def fetch_raw_race_info(persist: bool = False, file_name: str = None) -> List:
         "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
         " (KHTML, like Gecko) Chrome/66.0.3359.181 Safari/537.36",
     }
+    # Only worth asking if we can fall back on the snapshot's copy for a 304
+    if snapshot and "info" in snapshot:
+        if snapshot.get("etag"):
+            headers["If-None-Match"] = snapshot["etag"]
+        if snapshot.get("last_modified"):
+            headers["If-Modified-Since"] = snapshot["last_modified"]
 
-    r = requests.get(
+    r = CLIENT.get(
         "https://api2.spartan.com/api/races/upcoming_past_planned",
         params={
             "new_api": "yes",
@@ -63,79 +88,147 @@ def fetch_raw_race_info(persist: bool = False, file_name: str = None) -> List:
         },
         headers=headers,
     )
+    if r.status_code == 304:
+        logging.info("Race info not modified since the last run")
+        return snapshot["info"]
+    r.raise_for_status()
 
     info = json.loads(r.text)["upcoming"]
+    if snapshot is not None:
+        snapshot["etag"] = r.headers.get("ETag")
+        snapshot["last_modified"] = r.headers.get("Last-Modified")
 
     if persist:
         _save(file_name, info)
     return info
 
 
-def main():
-    logging.basicConfig(
-        format="%(asctime)s - %(levelname)s - %(module)s: %(message)s",
-        level=logging.INFO,
+def build_race(overall_event) -> Race:
+    venue_info = overall_event["venue"]
+    return Race(
+        spartan_id=overall_event["id"],
+        name=overall_event["name"],
+        start_date=datetime.strptime(overall_event["start_date"], "%Y-%m-%d").date(),
+        venue_name=venue_info.get("name", "TBD"),
+        country=venue_info.get("country", "TBD"),
+        region=venue_info.get("region", "TBD"),
+        latitude=float(venue_info.get("latitude", "0.0")),
+        longitude=float(venue_info.get("longitude", "0.0")),
     )
 
-    logging.getLogger("chardet").setLevel(logging.WARNING)
-    logging.getLogger("requests").setLevel(logging.WARNING)
-    logging.getLogger("urllib3").setLevel(logging.WARNING)
-    logging.getLogger("peewee").setLevel(logging.WARNING)
 
-    logging.debug("Fetching data from Spartan")
-    info = fetch_raw_race_info(persist=False, file_name="race_info.json")
-    logging.debug("Time to compare what we found!")
+def build_event(e, overall_event) -> Event:
+    """
+    :raises: KeyError for events Spartan didn't give us enough to go on
+    """
+    if "start_date" in e:
+        start_date = datetime.strptime(e["start_date"], "%Y-%m-%d")
+    else:
+        start_date = date.today()
 
-    for overall_event in info:
-        venue_info = overall_event["venue"]
-        curr_race = Race(
-            spartan_id=overall_event["id"],
-            name=overall_event["name"],
-            start_date=datetime.strptime(
-                overall_event["start_date"], "%Y-%m-%d"
-            ).date(),
-            venue_name=venue_info.get("name", "TBD"),
-            country=venue_info.get("country", "TBD"),
-            region=venue_info.get("region", "TBD"),
-            latitude=float(venue_info.get("latitude", "0.0")),
-            longitude=float(venue_info.get("longitude", "0.0")),
+    # Fix up some poor quality data from Spartan
+    category_key = (
+        "category_identifier"
+        if "category_identifier" in e["category"]
+        else "category_name"
+    )
+    return Event(
+        spartan_id=e["id"],
+        # race=race,
+        category=e["category"][category_key],
+        name=e["name"],
+        race_id=e["race_id"],
+        start_date=start_date,
+        venue_name=overall_event["venue"].get("name", "TBD"),
+    )
+
+
+def _existing_by_spartan_id(model) -> Dict[int, BaseModel]:
+    # Same as Model.get(spartan_id=...) would give us, but in a single query
+    existing = {}
+    for row in model.select().order_by(model.id):
+        existing.setdefault(row.spartan_id, row)
+    return existing
+
+
+def _upsert(model, rows: List[BaseModel]) -> None:
+    """
+    Writes rows in batches; rows that already have an id replace that row.
+    """
+    fields = list(model._meta.fields)
+    batch_size = 999 // len(fields)
+    for with_id in (False, True):
+        batch = [
+            {k: v for k, v in row.__data__.items() if with_id or k != "id"}
+            for row in rows
+            if (row.id is not None) == with_id
+        ]
+        for chunk in chunked(batch, batch_size):
+            model.insert_many(chunk).on_conflict_replace().execute()
+
+
+def _compare(old, curr, writes: Dict[int, BaseModel], changes: List[Dict]) -> bool:
+    """
+    Queues `curr` for writing (and records why) if it's new or differs from `old`.
+    :return: True if it's new
+    """
+    table_name = curr._meta.table_name
+    if old is None:
+        writes[curr.spartan_id] = curr
+        changes.append(
+            dict(
+                table_name=table_name,
+                spartan_id=curr.spartan_id,
+                field=Change.INSERT,
+                old=None,
+                new=None,
+            )
         )
-        try:
-            old_race = Race.get(spartan_id=overall_event["id"])
-            diff = old_race.diff(curr_race)
-            if diff:
-                logging.info(diff)
-                curr_race.id = old_race.id
-                curr_race.save()
-        except Race.DoesNotExist:
-            curr_race.save()
+        return True
+
+    field_changes = old.changes(curr)
+    if field_changes:
+        logging.info(old.diff(curr))
+        curr.id = old.id
+        writes[curr.spartan_id] = curr
+        changes.extend(
+            dict(
+                table_name=table_name,
+                spartan_id=curr.spartan_id,
+                field=field,
+                old=str(ours),
+                new=str(theirs),
+            )
+            for field, ours, theirs in field_changes
+        )
+    return False
+
+
+def sync(info) -> None:
+    """
+    Compares the races/events Spartan gave us with what's in the db, logs any
+    differences, and writes every insert and update, plus a Change record for
+    each, in one transaction.
+    """
+    old_races = _existing_by_spartan_id(Race)
+    old_events = _existing_by_spartan_id(Event)
+    race_writes: Dict[int, Race] = {}
+    event_writes: Dict[int, Event] = {}
+    changes: List[Dict] = []
+
+    for overall_event in info:
+        curr_race = build_race(overall_event)
+        if _compare(
+            old_races.get(curr_race.spartan_id), curr_race, race_writes, changes
+        ):
             logging.info(
                 f"Saved {curr_race.name} ({curr_race.spartan_id}), "
                 "adding specific events"
             )
 
         for e in overall_event["events"]:
-            if "start_date" in e:
-                start_date = datetime.strptime(e["start_date"], "%Y-%m-%d")
-            else:
-                start_date = date.today()
-
-            # Fix up some poor quality data from Spartan
             try:
-                category_key = (
-                    "category_identifier"
-                    if "category_identifier" in e["category"]
-                    else "category_name"
-                )
-                curr_event = Event(
-                    spartan_id=e["id"],
-                    # race=race,
-                    category=e["category"][category_key],
-                    name=e["name"],
-                    race_id=e["race_id"],
-                    start_date=start_date,
-                    venue_name=venue_info.get("name", "TBD"),
-                )
+                curr_event = build_event(e, overall_event)
             except KeyError as ke:
                 # Item #1 overall_event["venue"]["name"] is missing - id 20 = Red deer
                 # Item #2 category_identifier missing for HH24HR
@@ -144,16 +237,67 @@ def main():
                 )
                 continue
 
-            try:
-                old_event = Event.get(spartan_id=e["id"])
-                diff = old_event.diff(curr_event)
-                if diff:
-                    logging.info(diff)
-                    curr_event.id = old_event.id
-                    curr_event.save()
-            except Event.DoesNotExist:
-                curr_event.save()
+            if _compare(
+                old_events.get(curr_event.spartan_id),
+                curr_event,
+                event_writes,
+                changes,
+            ):
                 logging.info(f"Saved {curr_event.name}!")
+
+    now = datetime.now()
+    with db.atomic():
+        _upsert(Race, list(race_writes.values()))
+        _upsert(Event, list(event_writes.values()))
+        for chunk in chunked(changes, 999 // 6):
+            Change.insert_many([dict(c, timestamp=now) for c in chunk]).execute()
+    logging.info(f"Wrote {len(race_writes)} races and {len(event_writes)} events")
+
+
+def main():
+    logging.basicConfig(
+        format="%(asctime)s - %(levelname)s - %(module)s: %(message)s",
+        level=logging.INFO,
+    )
+
+    logging.getLogger("chardet").setLevel(logging.WARNING)
+    logging.getLogger("requests").setLevel(logging.WARNING)
+    logging.getLogger("urllib3").setLevel(logging.WARNING)
+    logging.getLogger("peewee").setLevel(logging.WARNING)
+
+    migrate_db()
+    try:
+        snapshot = _load(SNAPSHOT_FILE)
+    except Exception:
+        snapshot = {}
+    if not Race.select().exists():
+        # Nothing to have been unchanged against
+        snapshot = {}
+
+    logging.debug("Fetching data from Spartan")
+    validators = (snapshot.get("etag"), snapshot.get("last_modified"))
+    info = fetch_raw_race_info(
+        persist=False, file_name="race_info.json.gz", snapshot=snapshot
+    )
+    info_hash = content_hash(info)
+    if info_hash == snapshot.get("content_hash"):
+        logging.info("Nothing has changed since the last run")
+        # A new ETag for the same content still earns next run's 304
+        if (snapshot.get("etag"), snapshot.get("last_modified")) != validators:
+            _save(SNAPSHOT_FILE, snapshot)
+        return
+
+    logging.debug("Time to compare what we found!")
+    race_hashes = {str(e["id"]): content_hash(e) for e in info}
+    old_hashes = snapshot.get("race_hashes", {})
+    changed = [
+        e for e in info if old_hashes.get(str(e["id"])) != race_hashes[str(e["id"])]
+    ]
+    logging.info(f"{len(changed)} of {len(info)} races changed since the last run")
+    sync(changed)
+
+    snapshot.update(content_hash=info_hash, race_hashes=race_hashes, info=info)
+    _save(SNAPSHOT_FILE, snapshot)
     logging.debug("Done!")
 
 
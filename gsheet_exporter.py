@@ -1,18 +1,29 @@
 #!/usr/bin/env python3
 
+import argparse
+import difflib
+import functools
 import itertools
+import json
 import os.path
 import re
 from datetime import date, datetime, timezone
-from typing import List
+from typing import Dict, List, Optional, Set, Tuple
 
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
+from peewee import fn
 
-from models import Event, Race
+from models import Change, Event, Race, SheetExport, db, migrate_db
+
+
+def _category_bits(
+    replacements: Dict[str, str], bits: Dict[str, int]
+) -> Dict[str, int]:
+    return {category: bits[field] for category, field in replacements.items()}
 
 
 class EventRow:
@@ -82,6 +93,27 @@ class EventRow:
         "/",
         " ,",
     ]
+    # All of the fragments at once, rather than a str.replace each
+    NAME_FRAGMENTS = re.compile("|".join(map(re.escape, NAME_FRAGMENTS_TO_DELETE)))
+    # Some events have their types mashed/together/like/so
+    MASHED_TYPES = re.compile(r" (\w+/)+\w+ ")
+    # Some throw the dates in
+    DATES = re.compile(r"[a-zA-Z]+ \d+-\d+")
+    DUPLICATED_WORDS = re.compile(r"\b(\w+)( +\1\b)+")
+    WHITESPACE = re.compile(r"\s+")
+
+    __slots__ = (
+        "start_date",
+        "name",
+        "event_id",
+        "event_link",
+        "venue_name",
+        "country",
+        "region",
+        "latitude",
+        "longitude",
+        "categories",
+    )
 
     def __init__(
         self, race: Race, events: List[Event], normalize_race_name=False
@@ -102,13 +134,14 @@ class EventRow:
             self.name = self.normalize_race_name(race.name)
         self.set_categories(events)
 
+    def __getattr__(self, field: str) -> bool:
+        # Only called for names that aren't slots, e.g. event_row.sprint
+        if field in self.CATEGORY_BITS:
+            return self.has(field)
+        raise AttributeError(field)
+
     def __repr__(self) -> str:
-        attrs = (
-            k
-            for k in self.__dict__.keys()
-            if k.startswith("__") is False
-            and k not in ["name", "start_date", "venue_name", "event_id", "event_link"]
-        )
+        attrs = ["country", "region", "latitude", "longitude", *self.RACE_ORDER]
         attr_strs = [f"{attr}={getattr(self, attr)}" for attr in sorted(attrs)]
         return (
             f'EventRow(start_date="{self.start_date}", name="{self.name}", '
@@ -116,39 +149,43 @@ class EventRow:
             f'{", ".join(attr_strs)}, event_link={self.event_link})'
         )
 
-    def normalize_race_name(self, race_name: str) -> str:
-        for fragment in self.NAME_FRAGMENTS_TO_DELETE:
-            race_name = race_name.replace(fragment, "")
-
-        # Some events have their types mashed/together/like/so
-        race_name = re.sub(r" (\w+/)+\w+ ", "", race_name)
-        # Some throw the dates in
-        race_name = re.sub(r"[a-zA-Z]+ \d+-\d+", "", race_name)
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def normalize_race_name(race_name: str) -> str:
+        """
+        Memoized, since the same race names come up year after year.
+        """
+        # Removing one fragment can leave another behind, e.g. "Super, X" -> " , X"
+        removed = True
+        while removed:
+            race_name, removed = EventRow.NAME_FRAGMENTS.subn("", race_name)
+        race_name = EventRow.MASHED_TYPES.sub("", race_name)
+        race_name = EventRow.DATES.sub("", race_name)
         # Remove duplicated words!
-        race_name = re.sub(r"\b(\w+)( +\1\b)+", r"\1", race_name)
+        race_name = EventRow.DUPLICATED_WORDS.sub(r"\1", race_name)
 
         # Collapse spaces
-        race_name = re.sub(r"\s+", " ", race_name)
+        race_name = EventRow.WHITESPACE.sub(" ", race_name)
 
         # trim up any leading/trailing whitespace
         race_name = race_name.strip()
         return race_name
 
     def set_categories(self, events: List[Event]) -> None:
-        event_categories = [
-            e.category for e in events if e.category not in self.IGNORED_CATEGORIES
-        ]
-        unknown_categories = set(event_categories) - set(
-            self.EVENT_CATEGORY_REPLACEMENTS.keys()
-        )
+        categories = 0
+        unknown_categories = set()
+        for e in events:
+            bit = self.EVENT_CATEGORY_BITS.get(e.category)
+            if bit is not None:
+                categories |= bit
+            elif e.category not in self.IGNORED_CATEGORIES:
+                unknown_categories.add(e.category)
         if unknown_categories:
             raise Exception(f"idk how to handle {unknown_categories} categories")
+        self.categories = categories
 
-        for category in self.EVENT_CATEGORY_REPLACEMENTS.values():
-            setattr(self, category, False)
-
-        for category in event_categories:
-            setattr(self, self.EVENT_CATEGORY_REPLACEMENTS[category], True)
+    def has(self, field: str) -> bool:
+        return bool(self.categories & self.CATEGORY_BITS[field])
 
     RACE_ORDER = [
         "kids",
@@ -166,6 +203,9 @@ class EventRow:
         "trail_50k",
         "trail_100k",
     ]
+    # Which bit of `categories` each RACE_ORDER field is, and each Event category
+    CATEGORY_BITS = {field: 1 << idx for idx, field in enumerate(RACE_ORDER)}
+    EVENT_CATEGORY_BITS = _category_bits(EVENT_CATEGORY_REPLACEMENTS, CATEGORY_BITS)
 
     def meta_to_sheet_row(self):
         return [
@@ -189,34 +229,85 @@ class EventRow:
             self.region,
         ]
 
-    @staticmethod
-    def _generate_update_cells_request(row_index: int, column_index: int):
+    @classmethod
+    def race_columns(cls) -> range:
+        return range(2, 2 + len(cls.RACE_ORDER))
+
+    def checkbox_cells(self, row_index: int) -> Set[Tuple[int, int]]:
+        """
+        :return: The (row, column) of every race category this event has
+        """
         return {
-            "updateCells": {
-                "rows": [
-                    {
-                        "values": [
-                            {
-                                "dataValidation": {"condition": {"type": "BOOLEAN"}},
-                            }
-                        ],
-                    }
-                ],
-                "fields": "dataValidation",
-                "start": {
+            (row_index, 2 + idx)
+            for idx in range(len(self.RACE_ORDER))
+            if self.categories >> idx & 1
+        }
+
+
+def _row_rectangles(cells: Set[Tuple[int, int]]) -> List[Tuple[int, int, int, int]]:
+    """
+    Covers the cells with (start_row, end_row, start_column, end_column)
+    rectangles, ends exclusive: runs of adjacent columns in a row, stacked while
+    the rows below have exactly the same run.
+    """
+    rectangles = []
+    # (start_column, end_column) -> [start_row, end_row] of the one still growing
+    open_rectangles: Dict[Tuple[int, int], List[int]] = {}
+    for row, row_cells in itertools.groupby(sorted(cells), lambda cell: cell[0]):
+        for _, run in itertools.groupby(
+            enumerate(column for _, column in row_cells),
+            lambda pair: pair[1] - pair[0],
+        ):
+            columns = [column for _, column in run]
+            span = (columns[0], columns[-1] + 1)
+            rows = open_rectangles.get(span)
+            if rows and rows[1] == row:
+                rows[1] = row + 1
+                continue
+            if rows:
+                rectangles.append((*rows, *span))
+            open_rectangles[span] = [row, row + 1]
+    rectangles.extend((*rows, *span) for span, rows in open_rectangles.items())
+    return rectangles
+
+
+def _rectangles(cells: Set[Tuple[int, int]]) -> List[Tuple[int, int, int, int]]:
+    """
+    Whichever of merging across rows first or down columns first (e.g. every
+    race with a sprint in a long run of weekends) takes fewer rectangles.
+    """
+    by_row = _row_rectangles(cells)
+    by_column = [
+        (start_row, end_row, start_column, end_column)
+        for start_column, end_column, start_row, end_row in _row_rectangles(
+            {(column, row) for row, column in cells}
+        )
+    ]
+    return sorted(min(by_row, by_column, key=len))
+
+
+def checkbox_requests(cells: Set[Tuple[int, int]], checked=True) -> List[Dict]:
+    """
+    Adds (or with checked=False, removes) the checkbox on each of the cells, with
+    one repeatCell request per rectangle of them rather than one per cell.
+    """
+    cell = {"dataValidation": {"condition": {"type": "BOOLEAN"}}} if checked else {}
+    return [
+        {
+            "repeatCell": {
+                "range": {
                     "sheetId": 0,
-                    "rowIndex": row_index,
-                    "columnIndex": column_index,
+                    "startRowIndex": start_row,
+                    "endRowIndex": end_row,
+                    "startColumnIndex": start_column,
+                    "endColumnIndex": end_column,
                 },
+                "cell": cell,
+                "fields": "dataValidation",
             }
         }
-
-    def races_to_sheet_row(self, row_index: int):
-        return [
-            self._generate_update_cells_request(row_index, 2 + idx)
-            for idx, field in enumerate(self.RACE_ORDER)
-            if getattr(self, field)
-        ]
+        for start_row, end_row, start_column, end_column in _rectangles(cells)
+    ]
 
 
 def create(title, creds):
@@ -264,8 +355,8 @@ def handle_creds() -> Credentials:
 
 def get_event_rows(starting_on_or_after: date) -> List[EventRow]:
     """
-    Queries the local db for `Race` objects, then again for the associated
-    `Event` objects.
+    Queries the local db for `Race` objects, then (in one more query, however many
+    races there are) for all of their `Event` objects.
 
     These are combined into `EventRow` objects.
     """
@@ -275,106 +366,392 @@ def get_event_rows(starting_on_or_after: date) -> List[EventRow]:
         .order_by(Race.start_date)
     )
 
+    events_by_race: Dict[int, List[Event]] = {}
+    for event in Event.select().where(
+        Event.race_id.in_(races.select(Race.spartan_id).order_by())
+    ):
+        events_by_race.setdefault(event.race_id, []).append(event)
+
+    return [EventRow(race, events_by_race.get(race.spartan_id, [])) for race in races]
+
+
+def location_info_data(events: List[EventRow]) -> List[Dict]:
+    """
+    The event date, name, and location info (venue/country/region) value ranges
+    """
     return [
-        EventRow(race, Event.select().where(Event.race_id == race.spartan_id))
-        for race in races
+        {
+            "range": f"A4:B{len(events) + 3}",
+            "values": [event_row.date_and_location_row() for event_row in events],
+        },
+        {
+            "range": f"Q4:S{len(events) + 3}",
+            "values": [event_row.country_region_row() for event_row in events],
+        },
     ]
 
 
-def set_location_info(creds, sheet_id, events: List[EventRow]) -> None:
+def race_info_requests(events: List[EventRow]) -> List[Dict]:
+    return checkbox_requests(
+        set().union(
+            *(event.checkbox_cells(3 + idx) for idx, event in enumerate(events))
+        )
+    )
+
+
+def metadata_data() -> Dict:
+    """
+    The metadata for the update
+    """
+    return {
+        "range": "Q1",
+        "values": [
+            [
+                "Last updated "
+                + datetime.now(tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%S %Z")
+            ]
+        ],
+    }
+
+
+def write_sheet(service, sheet_id, data: List[Dict], requests: List[Dict]) -> None:
     """
-    Sets the event date, name, and location info (venue/country/region)
+    Writes every value range in one values.batchUpdate, then applies every
+    formatting request in one spreadsheets.batchUpdate.
     """
     try:
-        service = build("sheets", "v4", credentials=creds)
-        range_name = f"A4:B{len(events) + 3}"
-        body = {"values": [event_row.date_and_location_row() for event_row in events]}
-        (
-            service.spreadsheets()
-            .values()
-            .update(
-                spreadsheetId=sheet_id,
-                range=range_name,
-                valueInputOption="USER_ENTERED",
-                body=body,
+        if data:
+            (
+                service.spreadsheets()
+                .values()
+                .batchUpdate(
+                    spreadsheetId=sheet_id,
+                    body={"valueInputOption": "USER_ENTERED", "data": data},
+                )
+                .execute()
             )
-            .execute()
-        )
-        range_name = f"Q4:S{len(events) + 3}"
-        body = {"values": [event_row.country_region_row() for event_row in events]}
-        (
-            service.spreadsheets()
-            .values()
-            .update(
-                spreadsheetId=sheet_id,
-                range=range_name,
-                valueInputOption="USER_ENTERED",
-                body=body,
+        if requests:
+            (
+                service.spreadsheets()
+                .batchUpdate(body={"requests": requests}, spreadsheetId=sheet_id)
+                .execute()
             )
-            .execute()
-        )
     except HttpError as error:
         print(f"An error occurred: {error}")
+        raise error
 
 
-def set_race_info(creds, sheet_id, events: List[EventRow]) -> None:
-    all_requests = [
-        event.races_to_sheet_row(3 + idx) for idx, event in enumerate(events)
-    ]
-    flat_requests = list(itertools.chain(*all_requests))
-    try:
-        service = build("sheets", "v4", credentials=creds)
-        (
-            service.spreadsheets()
-            .batchUpdate(
-                body={"requests": flat_requests},
-                spreadsheetId=sheet_id,
-            )
-            .execute()
+def update_sheet(service, sheet_id, events: List[EventRow]) -> None:
+    print("Setting location and race specific info")
+    write_sheet(
+        service,
+        sheet_id,
+        location_info_data(events) + [metadata_data()],
+        race_info_requests(events),
+    )
+
+
+def changed_races(since_change_id: int) -> Set[int]:
+    """
+    :return: spartan_ids of every Race that was added/updated, or had one of its
+      Events added/updated, after the given Change
+    """
+    changes = Change.select().where(Change.id > since_change_id)
+    race_ids = {c.spartan_id for c in changes if c.table_name == Race._meta.table_name}
+    event_ids = {
+        c.spartan_id for c in changes if c.table_name == Event._meta.table_name
+    }
+    if event_ids:
+        race_ids.update(
+            e.race_id
+            for e in Event.select(Event.race_id).where(Event.spartan_id.in_(event_ids))
         )
-    except HttpError as error:
-        print(f"An error occurred: {error}")
+    return race_ids
 
 
-def set_metadata(creds, sheet_id) -> None:
+def full_rewrite(
+    events: List[EventRow], sheet_rows: int
+) -> Tuple[List[Dict], List[Dict]]:
     """
-    Sets the metadata for the update
+    Writes every row over a sheet that already has `sheet_rows` race rows: any
+    rows past the new end are deleted, and every checkbox is cleared before the
+    new ones are added.
+    :return: (spreadsheets.batchUpdate requests, values.batchUpdate value ranges)
     """
-    try:
-        service = build("sheets", "v4", credentials=creds)
-        range_name = f"Q1"
-        body = {
-            "values": [
-                [
-                    "Last updated "
-                    + datetime.now(tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%S %Z")
-                ]
-            ]
-        }
-        (
-            service.spreadsheets()
-            .values()
-            .update(
-                spreadsheetId=sheet_id,
-                range=range_name,
-                valueInputOption="USER_ENTERED",
-                body=body,
+    requests = []
+    if sheet_rows > len(events):
+        requests.append(
+            {
+                "deleteDimension": {
+                    "range": _dimension(3 + len(events), sheet_rows - len(events))
+                }
+            }
+        )
+    requests += checkbox_requests(
+        {
+            (3 + idx, column)
+            for idx in range(len(events))
+            for column in EventRow.race_columns()
+        },
+        checked=False,
+    )
+    return requests + race_info_requests(events), location_info_data(events)
+
+
+def export_changes(service, sheet_id, events: List[EventRow]) -> None:
+    """
+    Only writes the rows whose race changed since the last export to this sheet.
+    Races that were added, removed or moved (e.g. to a new date) get rows inserted
+    or deleted, as sync_sheet does, rather than every row in between being
+    rewritten. The first export to a sheet writes everything.
+    """
+    last_change_id = Change.select(fn.MAX(Change.id)).scalar() or 0
+    layout = [event_row.event_id for event_row in events]
+    state = SheetExport.get_or_none(SheetExport.sheet_id == sheet_id)
+    if state is None:
+        print("No previous export, writing every row")
+        update_sheet(service, sheet_id, events)
+    else:
+        # What the sheet holds, going by the journal: races that haven't changed
+        # since the last export are still as they are now, the rest are unknown
+        changed = changed_races(state.last_change_id)
+        by_id = {event_row.event_id: event_row for event_row in events}
+        current = [
+            (race_id, None, None)
+            if race_id in changed or race_id not in by_id
+            else (
+                race_id,
+                _row_values(by_id[race_id]),
+                _checkbox_columns(by_id[race_id]),
             )
-            .execute()
+            for race_id in json.loads(state.layout)
+        ]
+        requests, data = sheet_delta(current, events)
+        full_requests, full_data = full_rewrite(events, len(current))
+        if len(json.dumps(full_requests + full_data)) < len(
+            json.dumps(requests + data)
+        ):
+            print(f"{len(changed)} races changed, rewriting every row is smaller")
+            requests, data = full_requests, full_data
+        else:
+            print(
+                f"{len(changed)} races changed, sending {len(data)} value ranges "
+                f"and {len(requests)} other changes"
+            )
+        # Row inserts/deletes have to land before the values are written
+        write_sheet(service, sheet_id, [], requests)
+        write_sheet(service, sheet_id, data + [metadata_data()], [])
+
+    SheetExport.replace(
+        sheet_id=sheet_id, last_change_id=last_change_id, layout=json.dumps(layout)
+    ).execute()
+
+
+# Where each of an EventRow's values live in a sheet row, by 0-based column
+VALUE_COLUMNS = {0: 0, 1: 1, 16: 2, 17: 3, 18: 4}
+RACE_LINK = re.compile(r"/race/detail/(\d+)/")
+
+
+def _column_letter(column: int) -> str:
+    return chr(ord("A") + column)
+
+
+def read_sheet(
+    service, sheet_id
+) -> List[Tuple[Optional[int], Dict[int, str], Set[int]]]:
+    """
+    Reads every race row's cell contents and checkboxes in a single request.
+    :return: [(race spartan_id or None, {column: text}, {checkbox columns})], one
+      per sheet row from row 4 on
+    """
+    response = (
+        service.spreadsheets()
+        .get(
+            spreadsheetId=sheet_id,
+            ranges=["A4:S"],
+            fields="sheets.data.rowData.values"
+            "(userEnteredValue,formattedValue,dataValidation)",
         )
-    except HttpError as error:
-        print(f"An error occurred: {error}")
+        .execute()
+    )
+    rows = []
+    for row_data in response["sheets"][0]["data"][0].get("rowData", []):
+        texts = {}
+        checkboxes = set()
+        for column, cell in enumerate(row_data.get("values", [])):
+            text = cell.get("userEnteredValue", {}).get(
+                "formulaValue", cell.get("formattedValue", "")
+            )
+            if text:
+                texts[column] = text
+            if cell.get("dataValidation", {}).get("condition", {}).get("type") == (
+                "BOOLEAN"
+            ):
+                checkboxes.add(column)
+        link = RACE_LINK.search(texts.get(1, ""))
+        rows.append((int(link.group(1)) if link else None, texts, checkboxes))
+    return rows
+
+
+def _row_values(event_row: EventRow) -> Dict[int, str]:
+    values = event_row.date_and_location_row() + event_row.country_region_row()
+    return {column: str(values[idx]) for column, idx in VALUE_COLUMNS.items()}
+
+
+def _checkbox_columns(event_row: EventRow) -> Set[int]:
+    return {column for _, column in event_row.checkbox_cells(0)}
+
+
+def _dimension(row_index: int, count: int) -> Dict:
+    return {
+        "sheetId": 0,
+        "dimension": "ROWS",
+        "startIndex": row_index,
+        "endIndex": row_index + count,
+    }
+
+
+def _value_range(span: Tuple[int, int], row_index: int, rows: List[List[str]]) -> Dict:
+    first_column, last_column = span
+    return {
+        "range": f"{_column_letter(first_column)}{row_index + 1}:"
+        f"{_column_letter(last_column)}{row_index + len(rows)}",
+        "values": rows,
+    }
+
+
+def sheet_delta(current, events: List[EventRow]) -> Tuple[List[Dict], List[Dict]]:
+    """
+    The smallest set of writes that turn the `current` sheet (from read_sheet)
+    into `events`. Rows are matched up by race, so a race that's added, removed
+    or moves gets a row inserted/deleted rather than every row below it being
+    rewritten (which also keeps anything typed into a row with its race).
+    A `current` row whose texts and checkboxes are None is rewritten in full.
+    :return: (spreadsheets.batchUpdate requests, values.batchUpdate value ranges)
+    """
+    matcher = difflib.SequenceMatcher(
+        a=[race_id for race_id, _, _ in current],
+        b=[event_row.event_id for event_row in events],
+        autojunk=False,
+    )
+    opcodes = matcher.get_opcodes()
+
+    requests = []
+    # Bottom up, so the row indexes of the changes still to come don't move
+    for tag, i1, i2, j1, j2 in reversed(opcodes):
+        if tag in ("delete", "replace"):
+            requests.append({"deleteDimension": {"range": _dimension(3 + i1, i2 - i1)}})
+        if tag in ("insert", "replace"):
+            requests.append(
+                {
+                    "insertDimension": {
+                        "range": _dimension(3 + i1, j2 - j1),
+                        "inheritFromBefore": False,
+                    }
+                }
+            )
+
+    # Which current row (if any) each new row was, now those changes are made
+    previous: List[Optional[int]] = [None] * len(events)
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == "equal":
+            previous[j1:j2] = range(i1, i2)
+
+    data = []
+    # (first column, last column) -> (first row index, [row values]) of each run of
+    # rows with the same changed cells that's still growing
+    runs: Dict[Tuple[int, int], Tuple[int, List[List[str]]]] = {}
+    checked = set()
+    cleared = set()
+    for idx, event_row in enumerate(events):
+        row_index = 3 + idx
+        new_checkboxes = _checkbox_columns(event_row)
+        old = current[previous[idx]] if previous[idx] is not None else None
+        if old is None or old[1] is None:
+            old_values = {}
+            checked.update((row_index, column) for column in new_checkboxes)
+            # Don't trust whatever the row inherited, or last had in it. Clearing
+            # the whole row (the checks are applied after) lets runs of rewritten
+            # rows share a rectangle.
+            cleared.update((row_index, column) for column in EventRow.race_columns())
+        else:
+            _, old_values, old_checkboxes = old
+            checked.update(
+                (row_index, column) for column in new_checkboxes - old_checkboxes
+            )
+            cleared.update(
+                (row_index, column) for column in old_checkboxes - new_checkboxes
+            )
 
+        new_values = _row_values(event_row)
+        changed = [
+            column
+            for column, text in new_values.items()
+            if old_values.get(column, "") != text
+        ]
+        # One value range per run of adjacent changed cells, shared with the rows
+        # above when they changed the same cells
+        for _, run in itertools.groupby(
+            enumerate(changed), lambda pair: pair[1] - pair[0]
+        ):
+            columns = [column for _, column in run]
+            span = (columns[0], columns[-1])
+            values = [new_values[column] for column in columns]
+            if span in runs and runs[span][0] + len(runs[span][1]) == row_index:
+                runs[span][1].append(values)
+                continue
+            if span in runs:
+                data.append(_value_range(span, *runs[span]))
+            runs[span] = (row_index, [values])
+    data.extend(_value_range(span, *run) for span, run in runs.items())
+
+    requests += checkbox_requests(cleared, checked=False)
+    requests += checkbox_requests(checked)
+    return requests, data
+
+
+def sync_sheet(service, sheet_id, events: List[EventRow]) -> None:
+    """
+    Reads the sheet, then writes only the cells (and rows) that differ from
+    `events`: one read and at most two writes.
+    """
+    current = read_sheet(service, sheet_id)
+    requests, data = sheet_delta(current, events)
+    print(
+        f"Sheet has {len(current)} rows, sending {len(data)} value ranges and "
+        f"{len(requests)} other changes"
+    )
+    # Row inserts/deletes have to land before the values are written
+    write_sheet(service, sheet_id, [], requests)
+    write_sheet(service, sheet_id, data + [metadata_data()], [])
 
-def update_sheet(creds, sheet_id, events: List[EventRow]) -> None:
-    print("Setting location info")
-    set_location_info(creds, sheet_id, events)
-    print("Race specific info")
-    set_race_info(creds, sheet_id, events)
-    set_metadata(creds, sheet_id)
+    SheetExport.replace(
+        sheet_id=sheet_id,
+        last_change_id=Change.select(fn.MAX(Change.id)).scalar() or 0,
+        layout=json.dumps([event_row.event_id for event_row in events]),
+    ).execute()
 
 
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Rewrite every row, rather than just the ones that changed",
+    )
+    parser.add_argument(
+        "--sync",
+        action="store_true",
+        help="Read the sheet and only write the cells that differ from the db",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Export to an in-memory fake sheet and report what would be sent",
+    )
+    args = parser.parse_args()
+
+    migrate_db()
     event_rows = get_event_rows(starting_on_or_after=date(2023, 1, 1))
     print(f"Found {len(event_rows)} events")
 
@@ -383,7 +760,27 @@ def main():
 
     # The one I shared in Spartan 4-0
     sheet_id = "1BN_z_2eO0GtMrbL-mzUzwhxxLkQVuPYKM-QYt6LY3Xg"
-    update_sheet(handle_creds(), sheet_id, event_rows)
+    export = sync_sheet if args.sync else export_changes
+    if args.dry_run:
+        from fake_sheets import FakeSheetsService
+
+        service = FakeSheetsService()
+        with db.atomic() as transaction:
+            if args.full:
+                SheetExport.delete().where(SheetExport.sheet_id == sheet_id).execute()
+            export(service, sheet_id, event_rows)
+            # Leave the export state alone, we didn't actually write anything
+            transaction.rollback()
+        print(
+            f"Would have made {service.round_trips} requests "
+            f"({service.payload_bytes:,} bytes)"
+        )
+        return
+
+    if args.full:
+        SheetExport.delete().where(SheetExport.sheet_id == sheet_id).execute()
+    service = build("sheets", "v4", credentials=handle_creds())
+    export(service, sheet_id, event_rows)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,135 @@
+"""
+The one HTTP client everything that talks to chronotrack or spartan.com uses.
+
+It holds a single keep-alive connection pool, asks for gzip, and retries
+transient failures (connection errors, timeouts, 429s and 5xxs) with jittered
+exponential backoff. Each host gets a budget: at most `concurrency` requests in
+flight, paced by an AdaptiveRateLimiter, so politeness and throughput are tuned
+here (see HOSTS) rather than with sleeps scattered through every script.
+
+    from http_client import CLIENT
+    response = CLIENT.get(url, params={...})
+"""
+import logging
+import random
+import threading
+import time
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from throttle import AdaptiveRateLimiter
+
+
+POOL_SIZE = 16
+RETRIES = 4
+# Seconds before the first retry, doubling for each one after that
+BACKOFF = 1.0
+TRANSIENT_STATUSES = {429, 500, 502, 503, 504}
+
+# Starting budgets per host, anything else gets DEFAULT_BUDGET
+HOSTS = {
+    "results.chronotrack.com": dict(concurrency=8, rate=2.0, max_rate=8.0),
+    "api2.spartan.com": dict(concurrency=1, rate=0.5, max_rate=2.0),
+}
+DEFAULT_BUDGET = dict(concurrency=4, rate=2.0, max_rate=8.0)
+
+
+class HostBudget:
+    def __init__(self, concurrency: int, rate: float, max_rate: float) -> None:
+        self.slots = threading.BoundedSemaphore(concurrency)
+        self.limiter = AdaptiveRateLimiter(
+            rate=rate, max_rate=max_rate, burst=max(1, concurrency)
+        )
+
+
+class HttpClient:
+    def __init__(
+        self,
+        hosts: Dict[str, Dict] = HOSTS,
+        pool_size: int = POOL_SIZE,
+        retries: int = RETRIES,
+        backoff: float = BACKOFF,
+    ) -> None:
+        self.retries = retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        self.session.headers["Accept-Encoding"] = "gzip, deflate"
+        self._mount(pool_size)
+
+        self._budgets = {host: HostBudget(**budget) for host, budget in hosts.items()}
+        self._lock = threading.Lock()
+
+    def _mount(self, pool_size: int) -> None:
+        # We do our own retrying, so every attempt goes through the budget
+        adapter = HTTPAdapter(pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.pool_size = pool_size
+
+    def configure(self, host: str, **budget) -> None:
+        """
+        Replaces a host's budget, e.g. race_finder matching it to its workers. The
+        connection pool grows to match, so every request in flight can keep its
+        connection alive.
+        """
+        budget = {**DEFAULT_BUDGET, **budget}
+        with self._lock:
+            self._budgets[host] = HostBudget(**budget)
+            if budget["concurrency"] > self.pool_size:
+                self._mount(max(POOL_SIZE, budget["concurrency"]))
+
+    def budget(self, url: str) -> HostBudget:
+        host = urlsplit(url).hostname
+        with self._lock:
+            if host not in self._budgets:
+                self._budgets[host] = HostBudget(**DEFAULT_BUDGET)
+            return self._budgets[host]
+
+    def _delay(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        delay = self.backoff * 2**attempt * random.uniform(0.5, 1.5)
+        try:
+            return max(delay, float(retry_after)) if retry_after else delay
+        except ValueError:
+            return delay
+
+    def get(
+        self, url: str, params=None, headers=None, timeout: float = 30, retries=None
+    ) -> requests.Response:
+        """
+        :return: The response, which may still be an error if it was one every
+          time (callers raise_for_status() as they see fit)
+        :raises: requests.ConnectionError/Timeout if every attempt failed to
+          get a response at all
+        """
+        retries = self.retries if retries is None else retries
+        budget = self.budget(url)
+        for attempt in range(retries + 1):
+            with budget.slots:
+                budget.limiter.acquire()
+                try:
+                    response = self.session.get(
+                        url, params=params, headers=headers, timeout=timeout
+                    )
+                except (requests.ConnectionError, requests.Timeout):
+                    budget.limiter.backoff()
+                    if attempt == retries:
+                        raise
+                    logging.debug(f"No response from {url}, retrying", exc_info=True)
+                    retry_after = None
+                else:
+                    retry_after = response.headers.get("Retry-After")
+                    budget.limiter.observe(response.status_code, retry_after)
+                    if (
+                        response.status_code not in TRANSIENT_STATUSES
+                        or attempt == retries
+                    ):
+                        return response
+                    logging.debug(f"Got a {response.status_code} from {url}, retrying")
+            time.sleep(self._delay(attempt, retry_after))
+
+
+# Shared by the whole process, so every thread is part of the same budget
+CLIENT = HttpClient()
@@ -1,21 +1,33 @@
 #!/usr/bin/env python3
 
 
-from datetime import date
+import logging
+from datetime import date, datetime
 
 import playhouse.migrate as migrate
 from peewee import *
 
-db = SqliteDatabase("races.db")
+db = SqliteDatabase(
+    "races.db",
+    pragmas={
+        "journal_mode": "wal",
+        "synchronous": "normal",
+        "cache_size": -16 * 1024,
+        "temp_store": "memory",
+    },
+)
 
 
 class BaseModel(Model):
     class Meta:
         database = db
 
-    def diff(self, other):
+    def changes(self, other):
+        """
+        :return: [(field, ours, theirs)] for every field that differs
+        """
         assert self.__class__ == other.__class__, "Not even the same class?!"
-        diffs = []
+        changes = []
         for k, v in self._meta.fields.items():
             if k == "id":
                 continue
@@ -23,17 +35,20 @@ class BaseModel(Model):
             us = getattr(self, k)
             them = self._meta.fields[k].python_value(getattr(other, k))
             if us != them:
-                diffs.append(
-                    f"{self.__class__.__name__}(name={self.name})"
-                    f".{k}: {getattr(self, k)} -> {getattr(other, k)}"
-                )
-        return ", ".join(diffs)
+                changes.append((k, us, getattr(other, k)))
+        return changes
+
+    def diff(self, other):
+        return ", ".join(
+            f"{self.__class__.__name__}(name={self.name}).{k}: {us} -> {them}"
+            for k, us, them in self.changes(other)
+        )
 
 
 class Race(BaseModel):
-    spartan_id = IntegerField()
+    spartan_id = IntegerField(unique=True)
     name = CharField()
-    start_date = DateField()
+    start_date = DateField(index=True)
     venue_name = CharField()
     country = CharField()
     region = CharField()
@@ -42,18 +57,136 @@ class Race(BaseModel):
 
 
 class Event(BaseModel):
-    spartan_id = IntegerField()
+    spartan_id = IntegerField(unique=True)
     # parent_race = ForeignKeyField(Race, backref='events')
     category = CharField()
     name = CharField()
-    race_id = IntegerField()
+    race_id = IntegerField(index=True)
     start_date = DateField(default=date.today())
     venue_name = CharField()
 
 
+class ResultRace(BaseModel):
+    """
+    One downloaded chronotrack race/bracket, i.e. one results CSV.
+    """
+
+    event_id = IntegerField()
+    race_id = IntegerField()
+    bracket_id = IntegerField()
+    year = IntegerField()
+    name = CharField()
+    heat = CharField()
+    path = CharField()
+    mtime = DoubleField()
+
+    class Meta:
+        indexes = (
+            (("event_id", "race_id", "bracket_id"), True),
+            (("year",), False),
+        )
+
+
+class RaceResult(BaseModel):
+    """
+    One finisher, as results_fetcher.RacerResult plus where they finished.
+    """
+
+    event_id = IntegerField()
+    race_id = IntegerField()
+    bracket_id = IntegerField()
+    racer_id = IntegerField()
+    rank = IntegerField()
+    name = CharField()
+    bib = CharField()
+    duration = IntegerField()
+    pace = CharField()
+    hometown = CharField()
+    age = IntegerField()
+    gender = CharField()
+    division = CharField()
+    division_rank = IntegerField()
+
+    class Meta:
+        indexes = (
+            (("event_id", "race_id", "bracket_id"), False),
+            (("division",), False),
+            (("gender", "age"), False),
+        )
+
+
+class AthletePosting(BaseModel):
+    """
+    Inverted index entry: a normalized name/bib/hometown key -> one RaceResult.
+    See athlete_index.py
+    """
+
+    key = CharField(index=True)
+    event_id = IntegerField()
+    race_id = IntegerField()
+    bracket_id = IntegerField()
+    result_id = IntegerField()
+
+    class Meta:
+        indexes = ((("event_id", "race_id", "bracket_id"), False),)
+
+
+class IndexedRace(BaseModel):
+    """
+    Which version (by file mtime) of each ResultRace the athlete index covers.
+    """
+
+    event_id = IntegerField()
+    race_id = IntegerField()
+    bracket_id = IntegerField()
+    mtime = DoubleField()
+
+    class Meta:
+        indexes = ((("event_id", "race_id", "bracket_id"), True),)
+
+
+class Change(BaseModel):
+    """
+    One insert or field update fetcher made to a Race/Event. Inserts are recorded
+    with field "*" and no old/new values.
+    """
+
+    INSERT = "*"
+
+    table_name = CharField()
+    spartan_id = IntegerField()
+    field = CharField()
+    old = TextField(null=True)
+    new = TextField(null=True)
+    timestamp = DateTimeField(default=datetime.now)
+
+
+class SheetExport(BaseModel):
+    """
+    How far gsheet_exporter has got with a sheet: the last Change it covers, and
+    the order of the races (by spartan_id) it wrote to the sheet's rows.
+    """
+
+    sheet_id = CharField(unique=True)
+    last_change_id = IntegerField(default=0)
+    layout = TextField(default="[]")
+
+
+MODELS = [
+    Event,
+    Race,
+    ResultRace,
+    RaceResult,
+    AthletePosting,
+    IndexedRace,
+    Change,
+    SheetExport,
+]
+
+
 def init_db():
     db.connect()
-    db.create_tables([Event, Race])
+    migrate_db()
     db.close()
 
 
@@ -74,5 +207,55 @@ def extended_location_migration():
         )
 
 
+def _add_location_columns():
+    # Databases that had extended_location_migration() run by hand already have them
+    if "venue_name" not in {c.name for c in db.get_columns("race")}:
+        extended_location_migration()
+
+
+def _unique_spartan_ids():
+    """
+    Drops all but the first row for each spartan_id (the one Model.get() has been
+    returning, so the one that's been kept up to date), then adds the indexes.
+    Every dropped row is logged first, so they can be checked (or restored).
+    """
+    for model in (Race, Event):
+        first_ids = model.select(fn.MIN(model.id)).group_by(model.spartan_id)
+        duplicates = list(model.select().where(model.id.not_in(first_ids)).dicts())
+        if duplicates:
+            spartan_ids = sorted({row["spartan_id"] for row in duplicates})
+            logging.warning(
+                f"Dropping {len(duplicates)} duplicate {model.__name__} rows for "
+                f"spartan_ids {spartan_ids}"
+            )
+            for row in duplicates:
+                logging.warning(f"  Dropping {model.__name__} {row}")
+            model.delete().where(model.id.not_in(first_ids)).execute()
+        model._schema.create_indexes(safe=True)
+
+
+# Append only! A database at version N has had the first N of these applied.
+MIGRATIONS = [
+    _add_location_columns,
+    _unique_spartan_ids,
+]
+
+
+def migrate_db() -> int:
+    """
+    Creates any missing tables, then applies whichever MIGRATIONS this database
+    hasn't seen yet, recording progress in SQLite's user_version.
+    :return: The schema version we ended up at
+    """
+    # Existing tables get their new indexes from the migrations, after any clean up
+    db.create_tables([model for model in MODELS if not model.table_exists()])
+    version = db.user_version
+    for number, migration in enumerate(MIGRATIONS[version:], version + 1):
+        with db.atomic():
+            migration()
+            db.user_version = number
+    return db.user_version
+
+
 if __name__ == "__main__":
-    print("Update me with what you want to do!")
+    print(f"races.db is at schema version {migrate_db()}")
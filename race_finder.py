@@ -1,87 +1,320 @@
-import random
-import time
+import argparse
+import mmap
 import pickle
 import os
-import requests
+import struct
+import json
 import logging
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Dict, List, Set
+from urllib.parse import urlsplit
+
+from http_client import CLIENT
+from chronotrack import decode_response, fetch_event_model, save_event_model
+from event_validator import EVENTS_FILE, LEGACY_EVENTS_FILE, iter_events
+from search_order import DensityScheduler
 
 
-SESSION = requests.Session()
 REQ_TMP = "https://results.chronotrack.com/event/results/event/event-{event_id}"
-STATE_FILE = "race_finder_state.pckl"
-random.seed()
+STATE_FILE = "race_finder_state.bin"
+LEGACY_STATE_FILE = "race_finder_state.pckl"
+WINNERS_FILE = "winners.txt"
+
+
+class ProbeState:
+    """
+    Remembers which IDs in [low, high] have been probed, one bit per ID.
+
+    The bitmap lives in a memory mapped file, so every probe is on disk (well, in
+    the page cache) as soon as it's marked and a crash or kill -9 only loses the
+    requests that were in flight. Resuming reads (high - low) / 8 bytes.
+    A file saved for a different range has its progress carried over to this one.
+    """
+
+    HEADER = struct.Struct("<II")
+
+    def __init__(self, file_name: str = STATE_FILE, low=2900, high=46713):
+        self.low = low
+        self.high = high
+        self.file_name = file_name
+        size = self.HEADER.size + (high - low) // 8 + 1
+
+        fresh = not os.path.exists(file_name)
+        if fresh:
+            logging.info(f"Starting from scratch between {low} and {high}")
+            self._write(bytes(size - self.HEADER.size))
+        else:
+            self._check_file(size)
+
+        self._f = open(file_name, "r+b")
+        try:
+            self._map = mmap.mmap(self._f.fileno(), size)
+        except Exception:
+            self._f.close()
+            raise
+
+        if fresh and os.path.exists(LEGACY_STATE_FILE):
+            self._import_legacy()
+
+    def _write(self, bitmap: bytes) -> None:
+        with open(self.file_name + ".tmp", "wb") as state_f:
+            state_f.write(self.HEADER.pack(self.low, self.high))
+            state_f.write(bitmap)
+        os.replace(self.file_name + ".tmp", self.file_name)
+
+    def _check_file(self, size: int) -> None:
+        """
+        Makes sure the file is `size` bytes for [low, high] before it's mapped.
+        """
+        with open(self.file_name, "r+b") as state_f:
+            header = state_f.read(self.HEADER.size)
+            if len(header) < self.HEADER.size:
+                raise ValueError(f"{self.file_name} is too short to be probe state")
+            saved_range = self.HEADER.unpack(header)
+            if saved_range == (self.low, self.high):
+                # Unset bits just mean "not probed yet", so padding is safe
+                if os.fstat(state_f.fileno()).st_size < size:
+                    state_f.truncate(size)
+                return
+            saved_bitmap = state_f.read()
 
+        saved_low, saved_high = saved_range
+        logging.info(
+            f"{self.file_name} covers {saved_low}-{saved_high}, carrying its "
+            f"progress over to {self.low}-{self.high}"
+        )
+        bitmap = bytearray(size - self.HEADER.size)
+        for event_id in range(max(self.low, saved_low), min(self.high, saved_high) + 1):
+            saved_offset = event_id - saved_low
+            saved_pos = saved_offset >> 3
+            if saved_pos < len(saved_bitmap) and saved_bitmap[saved_pos] & (
+                1 << (saved_offset & 7)
+            ):
+                offset = event_id - self.low
+                bitmap[offset >> 3] |= 1 << (offset & 7)
+        self._write(bytes(bitmap))
 
-def get_ids(low=2900, high=46713):
-    if os.path.exists(STATE_FILE):
-        with open(STATE_FILE, "rb") as state_f:
-            return pickle.load(state_f)
+    def _import_legacy(self) -> None:
+        with open(LEGACY_STATE_FILE, "rb") as state_f:
+            remaining = set(pickle.load(state_f))
+        logging.info(
+            f"Importing {LEGACY_STATE_FILE}, {len(remaining)} ids still to check"
+        )
+        for event_id in range(self.low, self.high + 1):
+            if event_id not in remaining:
+                self.mark(event_id)
+        self.flush()
 
-    logging.info(f"Generating candidates from scratch between {low} and {high}")
-    from_scratch = list(range(low, high + 1))
-    put_ids(from_scratch)
-    return from_scratch
+    def _locate(self, event_id: int):
+        offset = event_id - self.low
+        return self.HEADER.size + (offset >> 3), 1 << (offset & 7)
 
+    def is_done(self, event_id: int) -> bool:
+        pos, bit = self._locate(event_id)
+        return bool(self._map[pos] & bit)
 
-def put_ids(ids):
-    with open(STATE_FILE, "wb+") as state_f:
-        logging.info(f"Save {len(ids)} ids to check in the future")
-        pickle.dump(ids, state_f)
+    def mark(self, event_id: int) -> None:
+        pos, bit = self._locate(event_id)
+        self._map[pos] |= bit
+
+    def pending(self) -> List[int]:
+        return [
+            event_id
+            for event_id in range(self.low, self.high + 1)
+            if not self.is_done(event_id)
+        ]
+
+    def flush(self) -> None:
+        self._map.flush()
+
+    def close(self) -> None:
+        if not self._map.closed:
+            self._map.flush()
+            self._map.close()
+        self._f.close()
+
+
+def load_known_hits() -> Set[int]:
+    """
+    Everything we already know is a Spartan event, to seed the search order.
+    """
+    known = set()
+    if os.path.exists(WINNERS_FILE):
+        with open(WINNERS_FILE, "r", newline="") as in_f:
+            known.update(int(line) for line in in_f if line.strip())
+    if os.path.exists(EVENTS_FILE) or os.path.exists(LEGACY_EVENTS_FILE):
+        known.update(event["event"] for event in iter_events())
+    return known
 
 
 def save_winner(event_id):
-    with open("winners.txt", "a+", newline="") as out_f:
+    with open(WINNERS_FILE, "a+", newline="") as out_f:
         out_f.write(f"{event_id}\n")
 
 
-def main():
-    ids = get_ids()
-    random.shuffle(ids)
+def _check_status(response) -> None:
+    # Still unhappy after CLIENT's retries, so try this one again later
+    if response.status_code == 429 or response.status_code >= 500:
+        response.raise_for_status()
+
+
+def probe_page(event_id: int) -> bool:
+    """
+    Checks a single chronotrack event ID by downloading its whole results page.
+    :return: True if it looks like a Spartan event
+    :raises: requests.HTTPError if the host is unhappy and we should retry later
+    """
+    url = REQ_TMP.format(event_id=event_id)
+    response = CLIENT.get(url, timeout=30)
+    _check_status(response)
+
+    if response.status_code != 200:
+        logging.debug(f"Got a {response.status_code}, not 200 for {event_id}")
+        return False
+
+    if "spartan" not in response.text.lower():
+        logging.debug(f"Didn't see 'spartan' in the response for {event_id}")
+        return False
+
+    logging.info(f"Candidate: {url}")
+    return True
+
+
+def is_spartan(model) -> bool:
+    """
+    Classifies an event from its chronotrack model. Plenty of events are just
+    called "Las Vegas Super", so fall back to the rest of the (small) model when
+    the name doesn't say.
+    """
+    if "spartan" in str(model.get("name", "")).lower():
+        return True
+    return "spartan" in json.dumps(model).lower()
+
+
+def probe_model(event_id: int) -> bool:
+    """
+    Checks a single chronotrack event ID with one small load-model request, and
+    saves the model for race_section_fetcher when it's a hit.
+    :return: True if it looks like a Spartan event
+    :raises: requests.HTTPError if the host is unhappy and we should retry later
+    """
+    response = fetch_event_model(event_id)
+    _check_status(response)
+
+    if response.status_code != 200:
+        logging.debug(f"Got a {response.status_code}, not 200 for {event_id}")
+        return False
+
+    try:
+        info = decode_response(response)
+    except ValueError:
+        logging.debug(f"Couldn't decode the model for {event_id}")
+        return False
+
+    model = info.get("model") if isinstance(info, dict) else None
+    if not model:
+        logging.debug(f"No model for {event_id}")
+        return False
+
+    if not is_spartan(model):
+        logging.debug(f"{model.get('name')} ({event_id}) isn't a Spartan event")
+        return False
+
+    logging.info(f"Candidate: {event_id} {model.get('name')}")
+    save_event_model(event_id, response.content, info)
+    return True
+
+
+PROBES = {"page": probe_page, "model": probe_model}
+
+
+def main(
+    workers: int = 8, rate: float = 2.0, max_rate: float = 20.0, mode: str = "model"
+):
+    """
+    Probes every candidate ID with up to `workers` requests in flight, paced by an
+    adaptive token bucket starting at `rate` requests per second. IDs near known
+    Spartan events, and in dense blocks, go first.
+    `mode` picks the probe: "model" (one small load-model call that also captures
+    the event for race_section_fetcher) or "page" (the full results page).
+    """
+    probe = PROBES[mode]
+    state = ProbeState()
+    ids = DensityScheduler(state.pending(), load_known_hits())
     logging.info(f"Loaded up {len(ids)} candidates")
 
+    CLIENT.configure(
+        urlsplit(REQ_TMP).hostname, concurrency=workers, rate=rate, max_rate=max_rate
+    )
+    limiter = CLIENT.budget(REQ_TMP).limiter
+
     processed = 0
-    while ids:
-        try:
-            try:
-                event_id = ids.pop()
-                url = REQ_TMP.format(event_id=event_id)
-                response = SESSION.get(url)
-                processed += 1
+    in_flight: Dict[Future, int] = {}
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        while ids or in_flight:
+            while ids and len(in_flight) < workers:
+                event_id = ids.next()
+                in_flight[executor.submit(probe, event_id)] = event_id
 
-                if response.status_code != 200:
-                    logging.debug(
-                        f"Got a {response.status_code}, not 200 for {event_id}"
-                    )
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                event_id = in_flight[future]
+                try:
+                    hit = future.result()
+                    if hit:
+                        save_winner(event_id)
+                except Exception:
+                    logging.exception(f"Putting {event_id} at the end of the list")
+                    ids.retry(event_id)
                     continue
+                finally:
+                    del in_flight[future]
 
-                if "spartan" not in response.text.lower():
-                    logging.debug(
-                        f"Didn't see 'spartan' in the response for {event_id}"
+                ids.record(event_id, hit)
+                state.mark(event_id)
+                processed += 1
+                if processed % 500 == 0:
+                    state.flush()
+                    logging.info(
+                        f"Processed {processed}, {len(ids)} to go at "
+                        f"{limiter.rate:.2f} req/s"
                     )
-                    continue
+    except KeyboardInterrupt:
+        for future, event_id in in_flight.items():
+            future.cancel()
+            logging.info(f"Leaving {event_id} as unknown and exiting")
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        state.close()
 
-                logging.info(f"Candidate: {url}")
-                save_winner(event_id)
-            except Exception:
-                logging.exception(f"Putting {event_id} at the end of the list")
-                ids.append(event_id)
-            finally:
-                event_id = None
-                to_sleep = random.uniform(0.03, 3.09)
-                logging.debug(f"Snoozing for {to_sleep}s")
-                time.sleep(to_sleep)
-        except KeyboardInterrupt:
-            if event_id:
-                logging.info(f"Saving {event_id} as unknown and exiting")
-                ids.append(event_id)
-            put_ids(ids)
-            break
-    if not ids:
+    if not ids and not in_flight:
         logging.info("RAN OUT OF IDS! WOOO!")
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--workers", type=int, default=8, help="Probes to have in flight at once"
+    )
+    parser.add_argument(
+        "--rate", type=float, default=2.0, help="Starting requests per second"
+    )
+    parser.add_argument(
+        "--max-rate",
+        type=float,
+        default=20.0,
+        help="Requests per second the rate can climb to while chronotrack keeps up",
+    )
+    parser.add_argument(
+        "--mode",
+        choices=sorted(PROBES),
+        default="model",
+        help="Probe with the small load-model call or the full results page",
+    )
+    args = parser.parse_args()
+
     logging.basicConfig(
         format="%(asctime)s - %(levelname)s: %(message)s", level=logging.INFO
     )
-    main()
+    main(args.workers, args.rate, args.max_rate, args.mode)
@@ -1,20 +1,19 @@
 from datetime import datetime
-import random
-import time
+import argparse
 import logging
-import requests
 import json
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List
 
-
-SESSION = requests.Session()
-LOAD_MODEL = "https://results.chronotrack.com/embed/results/load-model"
+from chronotrack import get_event_model
 
 
 def get_info(event_id: int):
-    raw = SESSION.get(url=LOAD_MODEL, params={"modelID": "event", "eventID": event_id})
-    info = json.loads(raw.text[1:-2])
+    return parse_info(event_id, get_event_model(event_id))
+
 
+def parse_info(event_id: int, info):
     results = {
         "event": event_id,
         "name": info["model"]["name"].split("-")[0].strip(),
@@ -63,38 +62,74 @@ def get_info(event_id: int):
     return results
 
 
-def main():
+def pending_event_ids(output_dir: str, winners_file: str = "winners.txt") -> List[int]:
+    """
+    Every event in winners.txt without a <id>.json in output_dir yet, in order,
+    from a single listing of output_dir.
+    """
+    done = {
+        name[: -len(".json")]
+        for name in os.listdir(output_dir)
+        if name.endswith(".json")
+    }
+    with open(winners_file, "r", newline="") as in_f:
+        winners = dict.fromkeys(line.strip() for line in in_f)
+    return [int(event_id) for event_id in winners if event_id and event_id not in done]
+
+
+def save_info(output_dir: str, event_id: int, info) -> None:
+    """
+    Writes to a temp file and renames it into place, so <id>.json only ever
+    exists complete and an interrupted write just gets redone next time.
+    """
+    info_f_path = os.path.join(output_dir, f"{event_id}.json")
+    with open(info_f_path + ".tmp", "w", newline="") as out_f:
+        json.dump(info, out_f)
+    os.replace(info_f_path + ".tmp", info_f_path)
+
+
+def fetch_event(output_dir: str, event_id: int) -> None:
+    save_info(output_dir, event_id, get_info(event_id))
+
+
+def main(workers: int = 4):
+    """
+    Fetches every pending event with up to `workers` at a time, all within the
+    shared HTTP client's rate budget for chronotrack.
+    """
     output_dir = "raw_event_results"
     if not os.path.exists(output_dir):
         logging.error(f"Couldn't find output_dir ({output_dir}), giving up!")
         return
 
-    with open("winners.txt", "r", newline="") as in_f:
-        for event_id_str in in_f:
-            event_id_str = event_id_str.strip()
-            info_f_path = os.path.join(output_dir, f"{event_id_str}.json")
-            if os.path.exists(info_f_path):
-                logging.debug(f"Skipping {event_id_str}, {info_f_path} exists")
-                continue
+    event_ids = pending_event_ids(output_dir)
+    logging.info(f"{len(event_ids)} events to get info for")
 
-            logging.info(f"Getting info for {event_id_str}")
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = {
+            executor.submit(fetch_event, output_dir, event_id): event_id
+            for event_id in event_ids
+        }
+        for future in as_completed(futures):
             try:
-                info = get_info(int(event_id_str))
+                future.result()
+                logging.info(f"Wrote out info for {futures[future]}")
             except Exception:
-                logging.exception(f"Skipping {event_id_str}")
-                continue
-
-            with open(info_f_path, "w", newline="") as out_f:
-                logging.info("Writing out results")
-                json.dump(info, out_f)
-
-            to_sleep = random.uniform(0.03, 3.09)
-            logging.debug(f"Snoozing for {to_sleep}s")
-            time.sleep(to_sleep)
+                logging.exception(f"Skipping {futures[future]}")
+    finally:
+        # On Ctrl-C only wait for the fetches already running, not the queue
+        executor.shutdown(cancel_futures=True)
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--workers", type=int, default=4, help="Events to fetch at once"
+    )
+    args = parser.parse_args()
+
     logging.basicConfig(
         format="%(asctime)s - %(levelname)s: %(message)s", level=logging.INFO
     )
-    main()
+    main(args.workers)
@@ -0,0 +1,228 @@
+"""
+Finish time statistics over downloaded results, computed with NumPy.
+
+A race's results are loaded as arrays (from its .npz if columnar.py wrote one,
+otherwise from the CSV) and summarised without any per-finisher Python loops:
+overall, per-gender and per-division percentiles, plus a finish time histogram.
+Summaries are cached in .race_stats_cache/ keyed by the SHA-256 of the results
+file, so they're only recomputed when the file actually changes.
+
+    python race_stats.py race-results/2019/12345-67890-123456.csv
+    python race_stats.py --compare "Virginia" "Super"
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+import columnar
+from event_validator import iter_events
+from results_fetcher import read_results
+
+
+CACHE_DIR = ".race_stats_cache"
+CACHE_VERSION = 1
+PERCENTILES = [10, 25, 50, 75, 90]
+HISTOGRAM_BIN_SECONDS = 5 * 60
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as in_f:
+        for chunk in iter(lambda: in_f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_race(csv_path: str, year: int) -> Dict[str, np.ndarray]:
+    event_id, race_id, bracket_id = map(
+        int, os.path.basename(csv_path).rsplit(".", 1)[0].split("-")
+    )
+    npz_path = columnar.columnar_path(year, event_id, race_id, bracket_id)
+    if os.path.exists(npz_path) and os.path.getmtime(npz_path) >= os.path.getmtime(
+        csv_path
+    ):
+        return columnar.load_columns(npz_path)
+    return columnar.to_columns(read_results(csv_path))
+
+
+def grouped_percentiles(
+    keys: np.ndarray, durations: np.ndarray, percentiles: List[int] = PERCENTILES
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Percentiles of `durations` within each distinct key, in one sort: order by
+    (key, duration), find where each key's run starts, and index into the runs.
+    """
+    if not len(keys):
+        return {}
+
+    order = np.lexsort((durations, keys))
+    sorted_keys = keys[order]
+    sorted_durations = durations[order]
+    groups, starts, counts = np.unique(
+        sorted_keys, return_index=True, return_counts=True
+    )
+
+    fractions = np.asarray(percentiles) / 100.0
+    # Nearest rank, i.e. "lower" interpolation, for every group at once
+    offsets = np.floor(np.outer(counts - 1, fractions)).astype(np.int64)
+    values = sorted_durations[starts[:, None] + offsets]
+
+    return {
+        str(group): {
+            "count": int(count),
+            **{f"p{p}": int(v) for p, v in zip(percentiles, row)},
+        }
+        for group, count, row in zip(groups, counts, values)
+    }
+
+
+def summarize(columns: Dict[str, np.ndarray]) -> Dict[str, Any]:
+    finished = columns["duration"] > 0
+    durations = columns["duration"][finished]
+    summary: Dict[str, Any] = {"finishers": int(finished.sum())}
+    if not len(durations):
+        return summary
+
+    summary["overall"] = {
+        f"p{p}": int(v)
+        for p, v in zip(
+            PERCENTILES, np.percentile(durations, PERCENTILES, method="lower")
+        )
+    }
+    summary["mean"] = float(durations.mean())
+    summary["by_gender"] = grouped_percentiles(columns["gender"][finished], durations)
+    summary["by_division"] = grouped_percentiles(
+        columns["division"][finished], durations
+    )
+
+    top = int(durations.max()) // HISTOGRAM_BIN_SECONDS + 1
+    counts, edges = np.histogram(
+        durations,
+        bins=np.arange(0, (top + 1) * HISTOGRAM_BIN_SECONDS, HISTOGRAM_BIN_SECONDS),
+    )
+    first = int(np.flatnonzero(counts)[0])
+    summary["histogram"] = {
+        "bin_seconds": HISTOGRAM_BIN_SECONDS,
+        "start": int(edges[first]),
+        "counts": counts[first:].tolist(),
+    }
+    return summary
+
+
+def race_summary(csv_path: str, year: int) -> Dict[str, Any]:
+    """
+    The summary for one results file, from the cache when the file hasn't changed.
+    """
+    content_hash = file_hash(csv_path)
+    cache_path = os.path.join(CACHE_DIR, f"{content_hash}.json")
+    if os.path.exists(cache_path):
+        with open(cache_path, "r") as in_f:
+            cached = json.load(in_f)
+        if cached.get("version") == CACHE_VERSION:
+            return cached["summary"]
+
+    summary = summarize(load_race(csv_path, year))
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with open(cache_path + ".tmp", "w") as out_f:
+        json.dump({"version": CACHE_VERSION, "summary": summary}, out_f)
+    os.replace(cache_path + ".tmp", cache_path)
+    return summary
+
+
+def compare_years(
+    name_contains: str,
+    heat_contains: Optional[str] = None,
+    results_dir: str = columnar.CSV_DIR,
+) -> Dict[int, Dict[str, Any]]:
+    """
+    Year over year comparison of every race whose event name (and heat) contains
+    the given text, e.g. compare_years("Virginia", "Super").
+    :return: {year: {"races": [...], "p50": ..., "fastest_p10": ..., ...}} where
+      p50 is the finisher weighted average of that year's race medians
+    """
+    by_year: Dict[int, List[Dict[str, Any]]] = {}
+    for event in iter_events():
+        if name_contains.lower() not in event["name"].lower():
+            continue
+        for race in event["races"]:
+            if heat_contains and heat_contains.lower() not in race["heat"].lower():
+                continue
+            csv_path = os.path.join(
+                results_dir,
+                str(event["year"]),
+                "{event_id}-{race_id}-{bracket_id}.csv".format(**race),
+            )
+            if not os.path.exists(csv_path):
+                continue
+            summary = race_summary(csv_path, event["year"])
+            if "overall" not in summary:
+                continue
+            by_year.setdefault(event["year"], []).append(
+                {
+                    "event": event["name"],
+                    "heat": race["heat"],
+                    "finishers": summary["finishers"],
+                    **summary["overall"],
+                }
+            )
+
+    comparison = {}
+    for year in sorted(by_year):
+        races = by_year[year]
+        medians = np.array([race["p50"] for race in races])
+        weights = np.array([race["finishers"] for race in races])
+        comparison[year] = {
+            "races": races,
+            "finishers": int(weights.sum()),
+            "p50": int(np.average(medians, weights=weights)),
+            "fastest_p10": int(min(race["p10"] for race in races)),
+            "slowest_p90": int(max(race["p90"] for race in races)),
+        }
+    return comparison
+
+
+def _hms(seconds: int) -> str:
+    return f"{seconds // 3600}:{seconds // 60 % 60:02}:{seconds % 60:02}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("csv_paths", nargs="*", help="Results files to summarise")
+    parser.add_argument(
+        "--compare",
+        nargs="+",
+        metavar=("NAME", "HEAT"),
+        help="Compare every year of an event (and optionally heat)",
+    )
+    args = parser.parse_args()
+
+    for csv_path in args.csv_paths:
+        year = int(os.path.basename(os.path.dirname(csv_path)))
+        summary = race_summary(csv_path, year)
+        print(f"{csv_path}: {summary['finishers']:,} finishers")
+        for group, stats in summary.get("by_division", {}).items():
+            print(
+                f"  {group:>10} {stats['count']:>6,} "
+                + " ".join(_hms(stats[f"p{p}"]) for p in PERCENTILES)
+            )
+
+    if args.compare:
+        comparison = compare_years(*args.compare[:2])
+        for year, stats in comparison.items():
+            print(
+                f"{year}: {len(stats['races'])} races, {stats['finishers']:,} "
+                f"finishers, median {_hms(stats['p50'])} "
+                f"(p10 {_hms(stats['fastest_p10'])}, p90 {_hms(stats['slowest_p90'])})"
+            )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        format="%(asctime)s - %(levelname)s: %(message)s", level=logging.INFO
+    )
+    main()
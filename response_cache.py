@@ -0,0 +1,151 @@
+"""
+A content-addressed on-disk cache of raw HTTP response bodies.
+
+Bodies are stored gzipped under the SHA-256 of their content in
+<directory>/objects/, so identical responses are only stored once. A small
+SQLite index maps each request key to a body, when it expires, and when it was
+last used. Once the bodies add up to more than `max_bytes`, the least recently
+used entries are evicted.
+
+    cache = ResponseCache("chronotrack_cache")
+    body = cache.get("load-model/event/12345")
+    if body is None:
+        cache.put("load-model/event/12345", response.content, ttl=86400)
+"""
+import gzip
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+
+DAY = 24 * 60 * 60
+
+
+class ResponseCache:
+    def __init__(
+        self,
+        directory: str,
+        ttl: float = 365 * DAY,
+        max_bytes: int = 256 * 1024 * 1024,
+    ) -> None:
+        """
+        :param: ttl: Seconds an entry is good for, unless put() says otherwise
+        :param: max_bytes: Evict least recently used entries beyond this much
+          (compressed) content
+        """
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        # Opened on first use, so just importing a module with a cache is free
+        if self._db is None:
+            os.makedirs(os.path.join(self.directory, "objects"), exist_ok=True)
+            self._db = sqlite3.connect(
+                os.path.join(self.directory, "index.sqlite"),
+                check_same_thread=False,
+                isolation_level=None,
+            )
+            self._db.execute("PRAGMA journal_mode = wal")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS entry ("
+                " key TEXT PRIMARY KEY,"
+                " digest TEXT NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " expires REAL NOT NULL,"
+                " used REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS entry_used ON entry (used)")
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS entry_digest ON entry (digest)"
+            )
+        return self._db
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.directory, "objects", digest[:2], digest)
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        :return: The cached body, or None if there isn't one or it has expired
+        """
+        with self._lock:
+            db = self._connect()
+            row = db.execute(
+                "SELECT digest, expires FROM entry WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            digest, expires = row
+            now = time.time()
+            if expires < now:
+                return None
+            try:
+                with gzip.open(self._object_path(digest), "rb") as in_f:
+                    content = in_f.read()
+            except OSError:
+                logging.warning(f"Cached body for {key} is missing or corrupt")
+                self._delete(db, key, digest)
+                return None
+            db.execute("UPDATE entry SET used = ? WHERE key = ?", (now, key))
+            return content
+
+    def put(self, key: str, content: bytes, ttl: Optional[float] = None) -> None:
+        digest = hashlib.sha256(content).hexdigest()
+        path = self._object_path(digest)
+        with self._lock:
+            db = self._connect()
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with gzip.open(path + ".tmp", "wb") as out_f:
+                    out_f.write(content)
+                os.replace(path + ".tmp", path)
+
+            old = db.execute(
+                "SELECT digest FROM entry WHERE key = ?", (key,)
+            ).fetchone()
+            now = time.time()
+            db.execute(
+                "REPLACE INTO entry (key, digest, size, expires, used)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (
+                    key,
+                    digest,
+                    os.path.getsize(path),
+                    now + (self.ttl if ttl is None else ttl),
+                    now,
+                ),
+            )
+            if old and old[0] != digest:
+                self._remove_orphan(db, old[0])
+            self._evict(db)
+
+    def _delete(self, db: sqlite3.Connection, key: str, digest: str) -> None:
+        db.execute("DELETE FROM entry WHERE key = ?", (key,))
+        self._remove_orphan(db, digest)
+
+    def _remove_orphan(self, db: sqlite3.Connection, digest: str) -> None:
+        # Other keys can share a body, only remove it once nothing uses it
+        if db.execute("SELECT 1 FROM entry WHERE digest = ?", (digest,)).fetchone():
+            return
+        try:
+            os.remove(self._object_path(digest))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self, db: sqlite3.Connection) -> None:
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM entry").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, digest, size in db.execute(
+            "SELECT key, digest, size FROM entry ORDER BY used"
+        ).fetchall():
+            self._delete(db, key, digest)
+            total -= size
+            if total <= self.max_bytes:
+                break
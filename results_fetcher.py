@@ -10,18 +10,19 @@ After that I have to inspect the chronotrack results page for those values.
 Hopefully the next version will be able to do this via more direct linkage from a
 spartan.com race to athlinks to chronotrack, or just directly to athlinks.
 """
-from typing import Any, Dict, List, NamedTuple, Iterable
+from typing import Any, Deque, List, NamedTuple, Iterator, Tuple
 
+import argparse
 import csv
 import json
 import logging
 import os
-import random
-import requests
-import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 
-
-SESSION = requests.Session()
+from chronotrack import decode_response
+from event_validator import iter_events
+from http_client import CLIENT
 
 
 class RacerResult(NamedTuple):
@@ -39,20 +40,7 @@ class RacerResult(NamedTuple):
 
     @classmethod
     def build(cls, raw_input: List[Any]) -> "RacerResult":
-        field_types = list(RacerResult.__annotations__.values())
-        field_count = len(field_types)
-        assert len(raw_input) == field_count, "lol what is this even?"
-
-        raw_input[4] = sum(
-            a * b for a, b in zip([3600, 60, 1], map(int, raw_input[4].split(":")))
-        )
-        try:
-            return RacerResult(
-                *[field_types[i](raw_input[i]) for i in range(field_count)]
-            )
-        except ValueError:
-            logging.exception(f"With input ->{raw_input}<-")
-            raise
+        return decode_page([raw_input])[0]
 
     @classmethod
     def columns(cls) -> List[str]:
@@ -62,8 +50,68 @@ class RacerResult(NamedTuple):
         return self._asdict()
 
 
+def parse_duration(duration: str) -> int:
+    """
+    H:MM:SS to seconds. Shorter strings are read from the hours end, as they
+    always have been.
+    """
+    parts = duration.split(":")
+    if len(parts) == 3:
+        return int(parts[0]) * 3600 + int(parts[1]) * 60 + int(parts[2])
+    return sum(a * b for a, b in zip([3600, 60, 1], map(int, parts)))
+
+
+FIELD_TYPES = list(RacerResult.__annotations__.values())
+# One converter per RacerResult field, worked out once rather than per row
+CONVERTERS = [
+    parse_duration if name == "duration" else field_type
+    for name, field_type in RacerResult.__annotations__.items()
+]
+
+
+def decode_page(aa_data: List[List[Any]]) -> List[RacerResult]:
+    """
+    Turns a whole results-grid page into RacerResults in one pass: the page is
+    transposed so each field's converter runs over a whole column at once.
+    """
+    if not aa_data:
+        return []
+    assert all(
+        len(raw_input) == len(CONVERTERS) for raw_input in aa_data
+    ), "lol what is this even?"
+
+    try:
+        columns = [
+            list(map(converter, column))
+            for converter, column in zip(CONVERTERS, zip(*aa_data))
+        ]
+    except ValueError:
+        for raw_input in aa_data:
+            try:
+                [converter(v) for converter, v in zip(CONVERTERS, raw_input)]
+            except ValueError:
+                logging.exception(f"With input ->{raw_input}<-")
+                break
+        raise
+
+    return list(map(RacerResult._make, zip(*columns)))
+
+
+def read_results(csv_path: str) -> List[RacerResult]:
+    """
+    Reads back a CSV written by download_results.
+    """
+    with open(csv_path, "r", encoding="utf-8", newline="") as in_f:
+        reader = csv.reader(in_f)
+        next(reader)
+        return [
+            RacerResult(*[field_type(v) for field_type, v in zip(FIELD_TYPES, row)])
+            for row in reader
+        ]
+
+
 def get_info(event_id: int, race_id: int, bracket_id: int, start: int, length: int):
-    raw = SESSION.get(
+    raw = CLIENT.get(
         "https://results.chronotrack.com/embed/results/results-grid",
         params={
             "iDisplayStart": start,
@@ -72,23 +120,64 @@ def get_info(event_id: int, race_id: int, bracket_id: int, start: int, length: i
             "bracketID": bracket_id,
             "eventID": event_id,
         },
+        timeout=60,
     )
-    return json.loads(raw.text[1:-2])
+    raw.raise_for_status()
+    return decode_response(raw)
 
 
 def get_batch(
     event_id: int, race_id: int, bracket_id: int, start: int, length: int
-) -> Iterable[RacerResult]:
-    return (
-        RacerResult.build(record)
-        for record in get_info(event_id, race_id, bracket_id, start, length)["aaData"]
-    )
+) -> List[RacerResult]:
+    return decode_page(get_info(event_id, race_id, bracket_id, start, length)["aaData"])
+
+
+def iter_pages(
+    event_id: int,
+    race_id: int,
+    bracket_id: int,
+    first_start=0,
+    batch_size=500,
+    workers=4,
+) -> Iterator[Tuple[int, List[RacerResult]]]:
+    """
+    Yields (start, page) in rank order, beginning at `first_start`.
+    The first page tells us how many results there are, the rest are fetched
+    `workers` at a time (within CLIENT's chronotrack budget). Only a few pages are
+    ever in memory.
+    """
+    first_page = get_info(event_id, race_id, bracket_id, first_start, batch_size)
+    total_results = int(first_page["iTotalRecords"])
+    logging.info(f"  Have {total_results - first_start:,} results to fetch")
+    yield first_start, decode_page(first_page["aaData"])
 
+    start_positions = iter(range(first_start + batch_size, total_results, batch_size))
+    in_flight: Deque[Tuple[int, Future]] = deque()
+    executor = ThreadPoolExecutor(max_workers=workers)
 
-def get_metadata(event_id: int, race_id: int, bracket_id: int) -> Dict[str, int]:
-    # NOTE: Have to fetch _at least_ one record
-    info = get_info(event_id, race_id, bracket_id, 0, 1)
-    return {"total_results": int(info["iTotalRecords"])}
+    def submit_next():
+        start = next(start_positions, None)
+        if start is not None:
+            in_flight.append(
+                (
+                    start,
+                    executor.submit(
+                        get_batch, event_id, race_id, bracket_id, start, batch_size
+                    ),
+                )
+            )
+
+    try:
+        for _ in range(workers):
+            submit_next()
+        while in_flight:
+            start, future = in_flight.popleft()
+            page = future.result()
+            submit_next()
+            yield start, page
+    finally:
+        # Any failed page fails the race, so don't bother fetching the rest
+        executor.shutdown(cancel_futures=True)
 
 
 def get_results(
@@ -96,32 +185,82 @@ def get_results(
     race_id: int,
     bracket_id: int,
     batch_size=500,
-    min_sleep=0.03,
-    max_sleep=3.09,
+    workers=4,
 ) -> List[RacerResult]:
-    meta = get_metadata(event_id, race_id, bracket_id)
-    logging.info(f"  Have {meta['total_results']:,} results to fetch")
     results: List[RacerResult] = []
+    for _, page in iter_pages(
+        event_id, race_id, bracket_id, batch_size=batch_size, workers=workers
+    ):
+        results.extend(page)
+    return results
 
-    start_positions = range(0, meta["total_results"], batch_size)
-    sleeps = (random.uniform(min_sleep, max_sleep) for _ in start_positions)
-    for start in start_positions:
-        results.extend(get_batch(event_id, race_id, bracket_id, start, batch_size))
-        to_sleep = next(sleeps)
-        time.sleep(to_sleep)
 
-    return results
+def _save_checkpoint(checkpoint_name: str, offset: int, size: int) -> None:
+    with open(checkpoint_name + ".tmp", "w") as out_f:
+        json.dump({"offset": offset, "bytes": size}, out_f)
+    os.replace(checkpoint_name + ".tmp", checkpoint_name)
+
+
+def download_results(
+    event_id: int,
+    race_id: int,
+    bracket_id: int,
+    filename: str,
+    batch_size=500,
+    workers=4,
+) -> None:
+    """
+    Streams a race's results into `filename` a page at a time.
 
+    Rows go to `<filename>.part`, and after each page `<filename>.checkpoint`
+    records the next offset and how many bytes of the .part file are good. An
+    interrupted download picks up from there, and the .part file only becomes
+    `filename` once every page is in.
+    """
+    part_name = filename + ".part"
+    checkpoint_name = filename + ".checkpoint"
+
+    offset = 0
+    if os.path.exists(checkpoint_name) and os.path.exists(part_name):
+        with open(checkpoint_name, "r") as in_f:
+            checkpoint = json.load(in_f)
+        offset = checkpoint["offset"]
+        logging.info(f"  Resuming {filename} from result {offset:,}")
+        csv_file = open(part_name, "r+", encoding="utf-8", newline="")
+        csv_file.truncate(checkpoint["bytes"])
+        csv_file.seek(checkpoint["bytes"])
+        writer = csv.writer(csv_file)
+    else:
+        csv_file = open(part_name, "w", encoding="utf-8", newline="")
+        writer = csv.writer(csv_file)
+        writer.writerow(RacerResult.columns())
+
+    with csv_file:
+        for start, page in iter_pages(
+            event_id, race_id, bracket_id, offset, batch_size, workers
+        ):
+            writer.writerows(page)
+            csv_file.flush()
+            os.fsync(csv_file.fileno())
+            _save_checkpoint(checkpoint_name, start + batch_size, csv_file.tell())
+
+    os.replace(part_name, filename)
+    os.remove(checkpoint_name)
+
+
+def main(columnar=False):
+    """
+    :param: columnar: Also write a typed .npz copy of each race (needs numpy),
+      see columnar.py
+    """
+    if columnar:
+        import columnar as columnar_output
 
-def main():
     filename_format = "{event_id}-{race_id}-{bracket_id}.csv"
     output_dir = "race-results"
     skipped_events = []
 
-    with open("interesting_events.json", "r", newline="") as in_f:
-        interesting_events = json.load(in_f)
-
-    for event_info in interesting_events:
+    for event_info in iter_events():
         if not isinstance(event_info["year"], int):
             logging.warning(
                 f"{event_info['event']} has non-int year {event_info['year']}"
@@ -141,9 +280,13 @@ def main():
                 logging.info(f"  {filename} exists, skipping!")
                 continue
 
+            logging.info(f"  Writing to {filename}")
             try:
-                results = get_results(
-                    race_info["event_id"], race_info["race_id"], race_info["bracket_id"]
+                download_results(
+                    race_info["event_id"],
+                    race_info["race_id"],
+                    race_info["bracket_id"],
+                    filename,
                 )
             except Exception:
                 logging.exception(
@@ -151,22 +294,22 @@ def main():
                 )
                 continue
 
-            logging.info(f"  Writing to {filename}")
-            with open(filename, "w", encoding="utf-8", newline="") as csv_file:
-                writer = csv.DictWriter(csv_file, fieldnames=RacerResult.columns())
-                writer.writeheader()
-                for row in results:
-                    try:
-                        writer.writerow(row.as_dict())
-                    except Exception:
-                        logging.exception(f"Issue with {row}")
-                        raise
+            if columnar:
+                columnar_output.convert_csv(filename, event_info["year"])
         logging.info("Done!")
     logging.info("Done with all races!")
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument(
+        "--columnar",
+        action="store_true",
+        help="Also write a typed .npz copy of each race (needs numpy)",
+    )
+    args = parser.parse_args()
+
     logging.basicConfig(
         format="%(asctime)s - %(levelname)s: %(message)s", level=logging.INFO
     )
-    main()
+    main(args.columnar)
@@ -0,0 +1,165 @@
+"""
+Loads the race-results/<year>/*.csv tree into races.db so questions like
+"every elite woman 30-34 at every Beast in 2019" are an indexed query rather than
+a scan over hundreds of CSV files.
+
+Files that haven't changed since they were loaded are skipped, and each file is
+(re)loaded in its own transaction with batched inserts.
+"""
+import glob
+import logging
+import os
+from typing import Dict, Optional, Tuple
+
+from peewee import chunked
+
+from event_validator import iter_events
+from models import RaceResult, ResultRace, db, migrate_db
+from results_fetcher import read_results
+
+
+RESULTS_DIR = "race-results"
+RESULT_FIELDS = [
+    RaceResult.event_id,
+    RaceResult.race_id,
+    RaceResult.bracket_id,
+    RaceResult.racer_id,
+    RaceResult.rank,
+    RaceResult.name,
+    RaceResult.bib,
+    RaceResult.duration,
+    RaceResult.pace,
+    RaceResult.hometown,
+    RaceResult.age,
+    RaceResult.gender,
+    RaceResult.division,
+    RaceResult.division_rank,
+]
+# Stay under SQLite's (older) limit of 999 variables per statement
+BATCH_SIZE = 999 // len(RESULT_FIELDS)
+
+
+def load_race_names() -> Dict[Tuple[int, int, int], Tuple[str, str]]:
+    """
+    Event name and heat for every race we know about, keyed by
+    (event_id, race_id, bracket_id).
+    """
+    return {
+        (race["event_id"], race["race_id"], race["bracket_id"]): (
+            event["name"],
+            race["heat"],
+        )
+        for event in iter_events()
+        for race in event["races"]
+    }
+
+
+def load_file(csv_path: str, year: int, race_names) -> int:
+    """
+    :return: How many results were loaded, 0 if the file was already up to date
+    """
+    event_id, race_id, bracket_id = map(
+        int, os.path.basename(csv_path).rsplit(".", 1)[0].split("-")
+    )
+    mtime = os.path.getmtime(csv_path)
+    existing = ResultRace.get_or_none(
+        event_id=event_id, race_id=race_id, bracket_id=bracket_id
+    )
+    if existing and existing.mtime == mtime:
+        return 0
+
+    rows = [(event_id, race_id, bracket_id, *row) for row in read_results(csv_path)]
+    name, heat = race_names.get((event_id, race_id, bracket_id), ("", ""))
+    with db.atomic():
+        if existing:
+            RaceResult.delete().where(
+                (RaceResult.event_id == event_id)
+                & (RaceResult.race_id == race_id)
+                & (RaceResult.bracket_id == bracket_id)
+            ).execute()
+            existing.delete_instance()
+
+        ResultRace.create(
+            event_id=event_id,
+            race_id=race_id,
+            bracket_id=bracket_id,
+            year=year,
+            name=name,
+            heat=heat,
+            path=csv_path,
+            mtime=mtime,
+        )
+        for batch in chunked(rows, BATCH_SIZE):
+            RaceResult.insert_many(batch, fields=RESULT_FIELDS).execute()
+    return len(rows)
+
+
+def find_results(
+    year: Optional[int] = None,
+    name_like: Optional[str] = None,
+    heat_like: Optional[str] = None,
+    gender: Optional[str] = None,
+    min_age: Optional[int] = None,
+    max_age: Optional[int] = None,
+    division: Optional[str] = None,
+):
+    """
+    e.g. find_results(2019, "%Beast%", "%Elite%", "F", 30, 34)
+    """
+    query = RaceResult.select(RaceResult, ResultRace).join(
+        ResultRace,
+        on=(
+            (RaceResult.event_id == ResultRace.event_id)
+            & (RaceResult.race_id == ResultRace.race_id)
+            & (RaceResult.bracket_id == ResultRace.bracket_id)
+        ),
+    )
+    if year is not None:
+        query = query.where(ResultRace.year == year)
+    if name_like is not None:
+        query = query.where(ResultRace.name**name_like)
+    if heat_like is not None:
+        query = query.where(ResultRace.heat**heat_like)
+    if gender is not None:
+        query = query.where(RaceResult.gender == gender)
+    if min_age is not None:
+        query = query.where(RaceResult.age >= min_age)
+    if max_age is not None:
+        query = query.where(RaceResult.age <= max_age)
+    if division is not None:
+        query = query.where(RaceResult.division == division)
+    return query.order_by(ResultRace.year, RaceResult.event_id, RaceResult.rank)
+
+
+def load_all() -> int:
+    """
+    Loads every new or changed results file.
+    :return: How many results were loaded
+    """
+    migrate_db()
+    race_names = load_race_names()
+
+    loaded = 0
+    for csv_path in sorted(glob.glob(os.path.join(RESULTS_DIR, "*", "*.csv"))):
+        year = int(os.path.basename(os.path.dirname(csv_path)))
+        try:
+            count = load_file(csv_path, year, race_names)
+        except Exception:
+            logging.exception(f"Skipping {csv_path}")
+            continue
+        if count:
+            logging.info(f"Loaded {count:,} results from {csv_path}")
+            loaded += count
+    return loaded
+
+
+def main():
+    loaded = load_all()
+    logging.info(f"Done! Loaded {loaded:,} results")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        format="%(asctime)s - %(levelname)s: %(message)s", level=logging.INFO
+    )
+    main()
@@ -0,0 +1,130 @@
+"""
+Decides which chronotrack event ID race_finder should probe next.
+
+Spartan events show up in clusters of nearby IDs, so a uniform shuffle wastes
+most of its requests on long empty stretches. This scheduler probes the
+neighbourhoods of known hits first, then works through fixed size blocks of the
+ID range in order of their estimated hit density, updating the estimate as
+results come in. Every ID is still probed eventually.
+"""
+import heapq
+import random
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+
+class DensityScheduler:
+    def __init__(
+        self,
+        pending: Iterable[int],
+        known_hits: Iterable[int],
+        block_size: int = 250,
+        radius: int = 10,
+        near_rate: float = 0.2,
+        prior_hits: float = 1.0,
+        prior_misses: float = 20.0,
+    ) -> None:
+        """
+        :param: pending: IDs that still need probing
+        :param: known_hits: IDs we already know are Spartan events
+        :param: block_size: How many consecutive IDs share a density estimate
+        :param: radius: How far either side of a hit counts as its neighbourhood
+        :param: near_rate: Chance the ID right next to a hit is a hit too, falling
+          off as 1/distance (which fits the gaps in interesting_events.json)
+        :param: prior_hits: Beta prior for blocks we know nothing about...
+        :param: prior_misses: ...which works out to roughly a 5% hit rate
+        """
+        self.block_size = block_size
+        self.radius = radius
+        self.near_rate = near_rate
+        self.prior_hits = prior_hits
+        self.prior_misses = prior_misses
+
+        self._remaining: Dict[int, Set[int]] = defaultdict(set)
+        for event_id in pending:
+            self._remaining[event_id // block_size].add(event_id)
+        self._count = sum(len(ids) for ids in self._remaining.values())
+        self._order: Dict[int, List[int]] = {}
+        for block, ids in self._remaining.items():
+            self._order[block] = list(ids)
+            random.shuffle(self._order[block])
+
+        self._hits: Dict[int, int] = defaultdict(int)
+        self._probed: Dict[int, int] = defaultdict(int)
+        self._nearby: List[Tuple[float, int]] = []
+        for event_id in set(known_hits):
+            self._hits[event_id // block_size] += 1
+            self._probed[event_id // block_size] += 1
+            self._add_neighbours(event_id)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _is_pending(self, event_id: int) -> bool:
+        return event_id in self._remaining.get(event_id // self.block_size, ())
+
+    def _add_neighbours(self, event_id: int) -> None:
+        for distance in range(1, self.radius + 1):
+            for neighbour in (event_id - distance, event_id + distance):
+                if self._is_pending(neighbour):
+                    chance = self.near_rate / distance
+                    heapq.heappush(self._nearby, (-chance, neighbour))
+
+    def density(self, block: int) -> float:
+        """
+        Posterior mean hit rate for a block.
+        """
+        return (self._hits[block] + self.prior_hits) / (
+            self._probed[block] + self.prior_hits + self.prior_misses
+        )
+
+    def _take(self, event_id: int) -> int:
+        block = event_id // self.block_size
+        self._remaining[block].remove(event_id)
+        self._count -= 1
+        if not self._remaining[block]:
+            del self._remaining[block]
+            del self._order[block]
+        return event_id
+
+    def next(self) -> Optional[int]:
+        """
+        :return: The next ID to probe, or None once everything has been handed out
+        """
+        while self._nearby and not self._is_pending(self._nearby[0][1]):
+            heapq.heappop(self._nearby)
+
+        if not self._remaining:
+            return None
+
+        block = max(self._remaining, key=self.density)
+        if self._nearby and -self._nearby[0][0] > self.density(block):
+            return self._take(heapq.heappop(self._nearby)[1])
+
+        order = self._order[block]
+        while order[-1] not in self._remaining[block]:
+            order.pop()
+        return self._take(order.pop())
+
+    def record(self, event_id: int, hit: bool) -> None:
+        """
+        Feeds a probe result back in. Hits pull their neighbourhood forward.
+        """
+        block = event_id // self.block_size
+        self._probed[block] += 1
+        if hit:
+            self._hits[block] += 1
+            self._add_neighbours(event_id)
+
+    def retry(self, event_id: int) -> None:
+        """
+        Puts an ID whose probe failed back, behind everything else in its block.
+        """
+        if self._is_pending(event_id):
+            return
+        block = event_id // self.block_size
+        if block not in self._remaining:
+            self._order[block] = []
+        self._remaining[block].add(event_id)
+        self._count += 1
+        self._order[block].insert(0, event_id)
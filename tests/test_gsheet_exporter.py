@@ -0,0 +1,244 @@
+from datetime import date, timedelta
+from unittest import mock
+
+import pytest
+from peewee import SqliteDatabase
+
+import gsheet_exporter
+from fake_sheets import FakeSheetsService, parse_a1
+from gsheet_exporter import EventRow
+from models import MODELS, Change, Event, Race
+
+SHEET_ID = "sheet"
+
+
+@pytest.fixture
+def scratch_db():
+    scratch = SqliteDatabase(":memory:")
+    with scratch.bind_ctx(MODELS):
+        scratch.create_tables(MODELS)
+        yield scratch
+    scratch.close()
+
+
+def add_races(count: int, first: int = 0) -> None:
+    for idx in range(first, first + count):
+        Race.create(
+            spartan_id=1000 + idx,
+            name=f"Race {idx}",
+            start_date=date(2024, 1, 1) + timedelta(days=idx),
+            venue_name="Venue",
+            country="USA",
+            region="VA",
+            latitude=0.0,
+            longitude=0.0,
+        )
+        for offset, category in enumerate(["spartansprint", "spartanbeast"]):
+            Event.create(
+                spartan_id=2 * idx + offset,
+                category=category,
+                name=f"{category} {idx}",
+                race_id=1000 + idx,
+                start_date=date(2024, 1, 1),
+                venue_name="Venue",
+            )
+
+
+@pytest.mark.parametrize("race_count", [1, 5, 50])
+def test_get_event_rows_query_count(scratch_db, race_count):
+    add_races(race_count)
+
+    with mock.patch.object(
+        scratch_db, "execute_sql", wraps=scratch_db.execute_sql
+    ) as execute_sql:
+        rows = gsheet_exporter.get_event_rows(date(2024, 1, 1))
+
+    # One for the races, one for all of their events
+    assert execute_sql.call_count == 2
+    assert len(rows) == race_count
+    assert all(row.sprint and row.beast and not row.super for row in rows)
+
+
+def event_rows():
+    return gsheet_exporter.get_event_rows(date(2024, 1, 1))
+
+
+def sheet_contents(service: FakeSheetsService):
+    """
+    Every race row's values and checkboxes, leaving out the "Last updated" stamp
+    """
+    return (
+        {cell: value for cell, value in service.values.items() if cell[0] >= 3},
+        set(service.validation),
+    )
+
+
+def full_export(rows):
+    service = FakeSheetsService()
+    gsheet_exporter.update_sheet(service, SHEET_ID, rows)
+    return sheet_contents(service)
+
+
+def move_race(spartan_id: int, start_date: date) -> None:
+    race = Race.get(Race.spartan_id == spartan_id)
+    Change.create(
+        table_name=Race._meta.table_name,
+        spartan_id=spartan_id,
+        field="start_date",
+        old=str(race.start_date),
+        new=str(start_date),
+    )
+    race.start_date = start_date
+    race.save()
+
+
+def checkbox(row: int, category: str):
+    return (row, 2 + EventRow.RACE_ORDER.index(category))
+
+
+def test_update_sheet(scratch_db):
+    add_races(3)
+    service = FakeSheetsService()
+
+    gsheet_exporter.update_sheet(service, SHEET_ID, event_rows())
+
+    # All the values in one batchUpdate, all the checkboxes in another
+    assert service.batch_updates == 2
+    assert service.values[(5, 0)] == "2024-01-03"
+    assert service.values[(5, 1)] == (
+        '=HYPERLINK("https://race.spartan.com/en/race/detail/1002/overview", '
+        '"Race 2")'
+    )
+    assert [service.values[(5, column)] for column in (16, 17, 18)] == [
+        "Venue",
+        "USA",
+        "VA",
+    ]
+    assert service.values[(0, 16)].startswith("Last updated ")
+    assert set(service.validation) == {
+        checkbox(row, category) for row in (3, 4, 5) for category in ("sprint", "beast")
+    }
+
+
+def test_export_changes(scratch_db):
+    add_races(5)
+    service = FakeSheetsService()
+    gsheet_exporter.export_changes(service, SHEET_ID, event_rows())
+    assert service.batch_updates == 2
+    assert sheet_contents(service) == full_export(event_rows())
+
+    # Nothing changed, so only the "Last updated" stamp is written
+    service.batch_updates = 0
+    gsheet_exporter.export_changes(service, SHEET_ID, event_rows())
+    assert service.batch_updates == 1
+
+    move_race(1000, date(2024, 2, 1))
+    Event.create(
+        spartan_id=100,
+        category="spartansuper",
+        name="spartansuper 2",
+        race_id=1002,
+        start_date=date(2024, 1, 1),
+        venue_name="Venue",
+    )
+    Change.create(
+        table_name=Event._meta.table_name, spartan_id=100, field=Change.INSERT
+    )
+    service.batch_updates = 0
+    gsheet_exporter.export_changes(service, SHEET_ID, event_rows())
+
+    assert service.batch_updates == 2
+    assert sheet_contents(service) == full_export(event_rows())
+    assert checkbox(4, "super") in service.validation
+
+
+def test_sync_sheet(scratch_db):
+    add_races(5)
+    service = FakeSheetsService()
+    gsheet_exporter.update_sheet(service, SHEET_ID, event_rows())
+
+    Event.delete().where(Event.race_id == 1001).execute()
+    Race.delete().where(Race.spartan_id == 1001).execute()
+    add_races(1, first=5)
+    service.round_trips = service.batch_updates = 0
+    gsheet_exporter.sync_sheet(service, SHEET_ID, event_rows())
+
+    # One read, then the row inserts/deletes, then the values
+    assert service.round_trips == 3
+    assert service.batch_updates == 2
+    assert sheet_contents(service) == full_export(event_rows())
+
+    service.round_trips = service.batch_updates = 0
+    gsheet_exporter.sync_sheet(service, SHEET_ID, event_rows())
+    assert service.round_trips == 2
+    assert service.batch_updates == 1
+
+
+def written_rows(write_sheet) -> set:
+    """
+    The sheet rows (0-based) every values.batchUpdate wrote to, leaving out Q1
+    """
+    rows = set()
+    for call in write_sheet.call_args_list:
+        for value_range in call.args[2]:
+            start_row, _, end_row, _ = parse_a1(value_range["range"])
+            rows.update(range(max(start_row, 3), end_row))
+    return rows
+
+
+def test_export_changes_only_touches_changed_rows(scratch_db):
+    add_races(30)
+    service = FakeSheetsService()
+    gsheet_exporter.export_changes(service, SHEET_ID, event_rows())
+    full_export_bytes = service.payload_bytes
+
+    move_race(1003, date(2024, 1, 20))
+    move_race(1010, date(2024, 1, 2))
+    move_race(1025, date(2024, 3, 1))
+    Event.create(
+        spartan_id=100,
+        category="spartansuper",
+        name="spartansuper 15",
+        race_id=1015,
+        start_date=date(2024, 1, 1),
+        venue_name="Venue",
+    )
+    Change.create(
+        table_name=Event._meta.table_name, spartan_id=100, field=Change.INSERT
+    )
+    add_races(2, first=40)
+    for spartan_id in (1040, 1041):
+        Change.create(
+            table_name=Race._meta.table_name,
+            spartan_id=spartan_id,
+            field=Change.INSERT,
+        )
+    service.payload_bytes = 0
+    with mock.patch.object(
+        gsheet_exporter, "write_sheet", wraps=gsheet_exporter.write_sheet
+    ) as write_sheet:
+        gsheet_exporter.export_changes(service, SHEET_ID, event_rows())
+
+    changed = {1003, 1010, 1025, 1015, 1040, 1041}
+    assert written_rows(write_sheet) == {
+        3 + idx
+        for idx, event_row in enumerate(event_rows())
+        if event_row.event_id in changed
+    }
+    assert service.payload_bytes < full_export_bytes
+    assert sheet_contents(service) == full_export(event_rows())
+
+
+def test_export_changes_reordered(scratch_db):
+    add_races(30)
+    service = FakeSheetsService()
+    gsheet_exporter.export_changes(service, SHEET_ID, event_rows())
+
+    # Every race moves, so rewriting every row beats moving them one by one
+    for idx in range(30):
+        move_race(1000 + idx, date(2024, 3, 1) - timedelta(days=idx))
+    Event.delete().where(Event.race_id == 1005).execute()
+    Race.delete().where(Race.spartan_id == 1005).execute()
+    gsheet_exporter.export_changes(service, SHEET_ID, event_rows())
+
+    assert sheet_contents(service) == full_export(event_rows())
@@ -0,0 +1,92 @@
+"""
+A token bucket that paces requests to a single host.
+
+Instead of a fixed random sleep after every request, callers `acquire()` a token
+before each request and report back how it went. Rate limiting (429) and server
+errors (5xx) cut the rate in half, while a run of good responses slowly raises it
+again, so we settle just under whatever the host is happy to serve.
+"""
+import logging
+import threading
+import time
+from typing import Optional
+
+
+class AdaptiveRateLimiter:
+    def __init__(
+        self,
+        rate: float = 2.0,
+        min_rate: float = 0.2,
+        max_rate: float = 20.0,
+        burst: float = 4.0,
+        increase: float = 0.1,
+        decrease: float = 0.5,
+    ) -> None:
+        """
+        :param: rate: Starting requests per second
+        :param: min_rate: Never back off below this many requests per second
+        :param: max_rate: Never speed up beyond this many requests per second
+        :param: burst: How many tokens can pile up while we're idle
+        :param: increase: Added to the rate after each good response
+        :param: decrease: Multiplied into the rate after each bad response
+        """
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.increase = increase
+        self.decrease = decrease
+
+        self._tokens = 1.0
+        self._last = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def acquire(self) -> None:
+        """
+        Blocks until a request may be sent.
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self._paused_until and self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                wait = max(self._paused_until - now, (1.0 - self._tokens) / self.rate)
+            time.sleep(wait)
+
+    def success(self) -> None:
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def backoff(self, retry_after: Optional[float] = None) -> None:
+        """
+        Slows down after a 429/5xx. If the host told us how long to wait via
+        Retry-After, nobody gets a token until that has passed.
+        """
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self._tokens = min(self._tokens, 0.0)
+            if retry_after:
+                self._paused_until = max(
+                    self._paused_until, time.monotonic() + retry_after
+                )
+            logging.debug(f"Backing off to {self.rate:.2f} req/s")
+
+    def observe(self, status_code: int, retry_after: Optional[str] = None) -> None:
+        """
+        Feeds a response status back into the limiter.
+        """
+        if status_code == 429 or status_code >= 500:
+            try:
+                delay = float(retry_after) if retry_after else None
+            except ValueError:
+                delay = None
+            self.backoff(delay)
+        else:
+            self.success()